@@ -7,19 +7,29 @@ Handles device connectivity, data storage, and ERPNext synchronization
 import os
 import sys
 import time
+import csv
+import io
 import json
 import logging
+import random
 import sqlite3
 import requests
 from datetime import datetime, timedelta
-from threading import Thread, Lock
-from typing import List, Dict, Optional
+from contextlib import nullcontext
+from threading import Event, Thread, Lock
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
 from dataclasses import dataclass
-from zklib import zklib
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, UniqueConstraint
+from requests.adapters import HTTPAdapter
+from sqlalchemy import create_engine, event, false, func, inspect, select, text, true, and_, or_, Column, Index, Integer, String, DateTime, Boolean, UniqueConstraint
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from flask import Flask, jsonify, request
+from sqlalchemy.pool import QueuePool, StaticPool
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+from zk_adms.metrics import Registry
+from zk_adms.parser import iter_lines, parse_upload
 
 # Configuration
 @dataclass
@@ -31,14 +41,34 @@ class Config:
     ERPNEXT_URL: str = "http://localhost:8000"
     ERPNEXT_API_KEY: str = ""
     ERPNEXT_API_SECRET: str = ""
+    ERPNEXT_TIMEOUT: int = 30  # seconds to wait on a connect or a response
     
     # Device Configuration
     DEVICES: List[Dict] = None
     
     # Polling
     POLL_INTERVAL: int = 30  # seconds
-    RETRY_ATTEMPTS: int = 3
-    RETRY_DELAY: int = 5
+    POLL_CONCURRENCY: int = 8  # devices polled at the same time
+    DEVICE_TIMEOUT: int = 60  # seconds before a device is abandoned for this cycle
+    DEVICE_SOCKET_TIMEOUT: int = 5  # seconds a device has to answer each command
+    CLEAR_DEVICE_BUFFER: bool = False  # clear device attendance once stored locally
+    
+    # Sync worker (runs beside the polling loop)
+    SYNC_INTERVAL: int = 10  # seconds between outbox scans when idle
+    SYNC_CONCURRENCY: int = 4  # ERPNext requests in flight at once
+    RETRY_DELAY: int = 5  # first backoff after a failed push, doubled per attempt
+    SYNC_MAX_BACKOFF: int = 900  # seconds
+    
+    # Employee mapping cache
+    EMPLOYEE_CACHE_TTL: int = 300  # seconds
+    EMPLOYEE_PAGE_SIZE: int = 1000
+    
+    # Batch sync (requires the zk_adms app on the ERPNext site)
+    SYNC_BATCH_SIZE: int = 0  # 0 = one request per log
+    
+    # ADMS push (devices posting to /iclock/ on the API port)
+    API_PORT: int = 5000
+    PUSH_DEVICE_OPTIONS: Dict = None  # overrides for the handshake options
     
     # Logging
     LOG_LEVEL: str = "INFO"
@@ -47,11 +77,48 @@ class Config:
 # Database Models
 Base = declarative_base()
 
+BULK_INSERT_CHUNK = 5000  # rows per executemany call in add_logs_bulk
+UNSYNCED_PAGE_SIZE = 500  # rows per page from iter_unsynced_logs
+STREAM_PAGE_SIZE = 1000  # rows fetched per round trip by stream_logs
+EMPLOYEE_MISS_REFRESH = 60  # seconds between map reloads triggered by an unknown user_id
+
+# Employee Checkin validation error for an existing (employee, time)
+DUPLICATE_CHECKIN_MESSAGE = 'already has a log with the same timestamp'
+
+# Handshake options sent to pushing devices (same defaults as zk_adms.commands)
+PUSH_DEVICE_OPTIONS = {
+    'ErrorDelay': 30,
+    'Delay': 10,
+    'TransTimes': '00:00;14:05',
+    'TransInterval': 1,
+    'TransFlag': 'TransData AttLog OpLog',
+    'Realtime': 1,
+    'Encrypt': 'None',
+}
+# Upload tables acknowledged through the Stamp in the handshake
+PUSH_STAMP_TABLES = ('ATTLOG', 'OPERLOG')
+
+# Metrics (served at /metrics in the Prometheus text format)
+METRICS = Registry()
+RECORDS_PARSED = METRICS.counter('zk_adms_records_parsed_total', 'Attendance records received, by device')
+RECORDS_INSERTED = METRICS.counter('zk_adms_records_inserted_total', 'New attendance logs stored, by device')
+RECORDS_DUPLICATE = METRICS.counter('zk_adms_records_duplicate_total', 'Attendance records already stored, by device')
+ICLOCK_REQUEST_SECONDS = METRICS.histogram(
+    'zk_adms_iclock_request_seconds', 'ADMS push request latency by endpoint and upload table'
+)
+DB_COMMIT_SECONDS = METRICS.histogram('zk_adms_db_commit_seconds', 'Write transaction time, by operation')
+ERPNEXT_REQUEST_SECONDS = METRICS.histogram('zk_adms_erpnext_request_seconds', 'ERPNext API latency, by endpoint')
+ERPNEXT_ERRORS = METRICS.counter(
+    'zk_adms_erpnext_errors_total', 'Failed ERPNext API requests, by endpoint and HTTP status (or "connection")'
+)
+DEVICE_POLL_SECONDS = METRICS.histogram('zk_adms_device_poll_seconds', 'Device poll duration, by device')
+DEVICE_POLL_ERRORS = METRICS.counter('zk_adms_device_poll_errors_total', 'Failed device polls, by device')
+
 class AttendanceLog(Base):
     __tablename__ = 'attendance_logs'
     
     id = Column(Integer, primary_key=True)
-    device_ip = Column(String(15), nullable=False)
+    device_ip = Column(String(50), nullable=False)  # polled or configured IP, else the pushing device's serial number
     user_id = Column(String(50), nullable=False)
     timestamp = Column(DateTime, nullable=False)
     status = Column(String(10), nullable=False)  # IN/OUT
@@ -60,50 +127,306 @@ class AttendanceLog(Base):
     
     __table_args__ = (
         UniqueConstraint('device_ip', 'user_id', 'timestamp', name='unique_attendance'),
+        # Sync outbox: keyset scans over unsynced rows (partial where supported)
+        Index(
+            'ix_attendance_logs_unsynced', 'synced_to_erpnext', 'id',
+            sqlite_where=synced_to_erpnext == false(),
+            postgresql_where=synced_to_erpnext == false()
+        ),
     )
 
+class DeviceWatermark(Base):
+    __tablename__ = 'device_watermarks'
+    
+    device_ip = Column(String(50), primary_key=True)  # as attendance_logs.device_ip; may be a hostname
+    last_timestamp = Column(DateTime, nullable=False)  # newest stored punch
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class SyncFailure(Base):
+    __tablename__ = 'sync_failures'
+    
+    log_id = Column(Integer, primary_key=True)  # attendance_logs.id
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(String(255))
+    dead = Column(Boolean, nullable=False, default=False)  # failed permanently, not retried
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class DeviceStamp(Base):
+    __tablename__ = 'device_stamps'
+    
+    serial_number = Column(String(50), primary_key=True)
+    attlog_stamp = Column(String(50))  # last stored ATTLOG upload
+    operlog_stamp = Column(String(50))  # last stored OPERLOG upload
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
 # Database Manager
 class DatabaseManager:
+    """Database access with a short-lived session per operation.
+    
+    Sessions come from the engine's connection pool, so Flask request
+    threads, the polling loop and device worker threads never share one.
+    Reads run concurrently; on SQLite writes are serialized in-process with
+    self.lock since the database only allows one writer at a time.
+    """
+    
     def __init__(self, database_url: str):
-        self.engine = create_engine(database_url)
+        engine_args = {'pool_pre_ping': True}
+        is_sqlite = database_url.startswith('sqlite')
+        if is_sqlite:
+            # Pooled connections are handed to whichever thread checks them out
+            engine_args['connect_args'] = {'check_same_thread': False}
+            if database_url in ('sqlite://', 'sqlite:///:memory:'):
+                # An in-memory database only exists on its one connection
+                engine_args['poolclass'] = StaticPool
+            else:
+                engine_args.update(poolclass=QueuePool, pool_size=5, max_overflow=10)
+        
+        self.engine = create_engine(database_url, **engine_args)
+        if is_sqlite:
+            event.listen(self.engine, 'connect', self._set_sqlite_pragmas)
         Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
-        self.lock = Lock()
+        # create_all skips existing tables, so add indexes introduced later
+        for index in AttendanceLog.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
+        for table in (AttendanceLog.__table__, DeviceWatermark.__table__):
+            self._widen_device_ip(table)
+        
+        # Objects stay readable after their session closes
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.lock = Lock() if is_sqlite else nullcontext()
+    
+    def _widen_device_ip(self, table):
+        """Widen a device_ip column created as VARCHAR(15) so it fits serial numbers and hostnames
+        
+        SQLite does not enforce VARCHAR lengths and needs no change.
+        """
+        dialect = self.engine.dialect.name
+        if dialect not in ('mysql', 'mariadb', 'postgresql'):
+            return
+        length = table.c.device_ip.type.length
+        column = next(c for c in inspect(self.engine).get_columns(table.name) if c['name'] == 'device_ip')
+        if (getattr(column['type'], 'length', None) or length) >= length:
+            return
+        if dialect == 'postgresql':
+            ddl = f'ALTER TABLE {table.name} ALTER COLUMN device_ip TYPE VARCHAR({length})'
+        else:
+            ddl = f'ALTER TABLE {table.name} MODIFY device_ip VARCHAR({length}) NOT NULL'
+        with self.engine.begin() as connection:
+            connection.execute(text(ddl))
+    
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL lets readers run alongside the writer; NORMAL sync is safe with WAL"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
     
     def add_log(self, device_ip: str, user_id: str, timestamp: datetime, status: str) -> bool:
         """Add attendance log, return True if new record"""
         with self.lock:
             try:
-                log = AttendanceLog(
-                    device_ip=device_ip,
-                    user_id=user_id,
-                    timestamp=timestamp,
-                    status=status
-                )
-                self.session.add(log)
-                self.session.commit()
+                with self.Session.begin() as session:
+                    session.add(AttendanceLog(
+                        device_ip=device_ip,
+                        user_id=user_id,
+                        timestamp=timestamp,
+                        status=status
+                    ))
                 return True
             except Exception:
-                self.session.rollback()
                 return False  # Duplicate or error
     
+    def _insert_ignore(self):
+        """INSERT that silently skips rows hitting the unique constraint"""
+        table = AttendanceLog.__table__
+        dialect = self.engine.dialect.name
+        if dialect == 'sqlite':
+            return sqlite_insert(table).on_conflict_do_nothing()
+        if dialect == 'postgresql':
+            return postgresql_insert(table).on_conflict_do_nothing()
+        if dialect in ('mysql', 'mariadb'):
+            return table.insert().prefix_with('IGNORE')
+        raise NotImplementedError(f"Bulk insert is not supported for {dialect}")
+    
+    def add_logs_bulk(self, logs: List[Dict]) -> int:
+        """Insert many logs in one transaction, skipping duplicates; return the number of new records
+        
+        Unlike add_log, errors other than duplicates are raised so callers
+        know the logs were not stored.
+        """
+        if not logs:
+            return 0
+        
+        now = datetime.now()
+        rows = [{
+            'device_ip': log['device_ip'],
+            'user_id': log['user_id'],
+            'timestamp': log['timestamp'],
+            'status': log['status'],
+            'synced_to_erpnext': False,
+            'created_at': now
+        } for log in logs]
+        
+        # One prepared statement executed over all rows (executemany); the
+        # driver batches them, and rowcount sums the rows actually inserted
+        stmt = self._insert_ignore()
+        new_count = 0
+        
+        with DB_COMMIT_SECONDS.time(operation='add_logs_bulk'), self.lock, self.Session.begin() as session:
+            for start in range(0, len(rows), BULK_INSERT_CHUNK):
+                result = session.execute(stmt, rows[start:start + BULK_INSERT_CHUNK])
+                new_count += max(result.rowcount, 0)
+        
+        return new_count
+    
     def get_unsynced_logs(self) -> List[AttendanceLog]:
         """Get logs not synced to ERPNext"""
-        return self.session.query(AttendanceLog).filter_by(synced_to_erpnext=False).all()
+        with self.Session() as session:
+            return session.query(AttendanceLog).filter_by(synced_to_erpnext=False).all()
+    
+    def iter_unsynced_logs(self, batch_size: int = UNSYNCED_PAGE_SIZE) -> Iterator[List[AttendanceLog]]:
+        """Yield unsynced logs in id order, one page at a time
+        
+        Pages are fetched by keyset (id > last seen id) on the unsynced index,
+        so memory and per-page cost stay flat however large the table grows.
+        Logs marked synced while iterating are simply not returned again.
+        """
+        last_id = 0
+        while True:
+            with self.Session() as session:
+                batch = session.query(AttendanceLog).filter(
+                    AttendanceLog.synced_to_erpnext == false(),
+                    AttendanceLog.id > last_id
+                ).order_by(AttendanceLog.id).limit(batch_size).all()
+            
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1].id
+    
+    def count_unsynced(self) -> int:
+        """Count logs not synced to ERPNext"""
+        with self.Session() as session:
+            return session.query(func.count(AttendanceLog.id)).filter(
+                AttendanceLog.synced_to_erpnext == false()
+            ).scalar()
     
     def mark_synced(self, log_id: int):
         """Mark log as synced"""
-        with self.lock:
-            log = self.session.query(AttendanceLog).get(log_id)
-            if log:
-                log.synced_to_erpnext = True
-                self.session.commit()
+        self.mark_synced_bulk([log_id])
+    
+    def mark_synced_bulk(self, log_ids: List[int]):
+        """Mark several logs as synced in one UPDATE"""
+        if not log_ids:
+            return
+        with DB_COMMIT_SECONDS.time(operation='mark_synced_bulk'), self.lock, self.Session.begin() as session:
+            # Keep IN lists well under bound parameter limits
+            for start in range(0, len(log_ids), UNSYNCED_PAGE_SIZE):
+                chunk = log_ids[start:start + UNSYNCED_PAGE_SIZE]
+                session.query(AttendanceLog).filter(
+                    AttendanceLog.id.in_(chunk)
+                ).update({AttendanceLog.synced_to_erpnext: True}, synchronize_session=False)
+                session.query(SyncFailure).filter(
+                    SyncFailure.log_id.in_(chunk)
+                ).delete(synchronize_session=False)
+    
+    def iter_due_logs(self, batch_size: int = UNSYNCED_PAGE_SIZE) -> Iterator[List[Tuple[AttendanceLog, int]]]:
+        """Yield unsynced logs due for a sync attempt, with their failed attempt counts
+        
+        Logs that never failed are always due, failed ones once their backoff
+        has passed; dead letters are skipped. Paged by keyset like
+        iter_unsynced_logs.
+        """
+        last_id = 0
+        while True:
+            with self.Session() as session:
+                rows = session.query(AttendanceLog, SyncFailure.attempts).outerjoin(
+                    SyncFailure, SyncFailure.log_id == AttendanceLog.id
+                ).filter(
+                    AttendanceLog.synced_to_erpnext == false(),
+                    AttendanceLog.id > last_id,
+                    or_(
+                        SyncFailure.log_id.is_(None),
+                        and_(SyncFailure.dead == false(), SyncFailure.next_attempt_at <= datetime.now())
+                    )
+                ).order_by(AttendanceLog.id).limit(batch_size).all()
+            
+            if not rows:
+                return
+            yield [(log, attempts or 0) for log, attempts in rows]
+            last_id = rows[-1][0].id
+    
+    def record_sync_failures(self, failures: List[Dict]):
+        """Save the retry state of logs that failed to sync
+        
+        Each dict holds log_id, attempts, next_attempt_at, last_error and dead.
+        """
+        if not failures:
+            return
+        with DB_COMMIT_SECONDS.time(operation='record_sync_failures'), self.lock, self.Session.begin() as session:
+            for failure in failures:
+                session.merge(SyncFailure(**failure))
+    
+    def count_dead_letters(self) -> int:
+        """Count logs that failed permanently and are no longer retried"""
+        with self.Session() as session:
+            return session.query(func.count(SyncFailure.log_id)).filter(SyncFailure.dead == true()).scalar()
+    
+    def requeue_dead_letters(self) -> int:
+        """Make dead letters due again (e.g. after fixing employee mappings), return how many"""
+        with self.lock, self.Session.begin() as session:
+            return session.query(SyncFailure).filter(
+                SyncFailure.dead == true()
+            ).delete(synchronize_session=False)
+    
+    def get_watermark(self, device_ip: str) -> Optional[datetime]:
+        """Get the newest stored timestamp for a device"""
+        with self.Session() as session:
+            watermark = session.get(DeviceWatermark, device_ip)
+            return watermark.last_timestamp if watermark else None
+    
+    def set_watermark(self, device_ip: str, timestamp: datetime):
+        """Advance the device watermark (never moves backwards)"""
+        with self.lock, self.Session.begin() as session:
+            watermark = session.get(DeviceWatermark, device_ip)
+            if not watermark:
+                session.add(DeviceWatermark(device_ip=device_ip, last_timestamp=timestamp))
+            elif timestamp > watermark.last_timestamp:
+                watermark.last_timestamp = timestamp
+    
+    def get_stamps(self, serial_number: str) -> Dict[str, Optional[str]]:
+        """Get the last acknowledged upload Stamp per table for a pushing device"""
+        with self.Session() as session:
+            stamp = session.get(DeviceStamp, serial_number)
+            return {
+                'ATTLOG': stamp.attlog_stamp if stamp else None,
+                'OPERLOG': stamp.operlog_stamp if stamp else None
+            }
+    
+    def set_stamp(self, serial_number: str, table: str, value: str):
+        """Record the Stamp of a stored upload"""
+        column = f'{table.lower()}_stamp'
+        with self.lock, self.Session.begin() as session:
+            stamp = session.get(DeviceStamp, serial_number)
+            if not stamp:
+                stamp = DeviceStamp(serial_number=serial_number)
+                session.add(stamp)
+            setattr(stamp, column, value)
     
     def get_all_logs(self) -> List[Dict]:
         """Get all logs as dict"""
-        logs = self.session.query(AttendanceLog).all()
-        return [{
+        with self.Session() as session:
+            logs = session.query(AttendanceLog).all()
+        return [self.log_to_dict(log) for log in logs]
+    
+    @staticmethod
+    def log_to_dict(log) -> Dict:
+        """Serialize an AttendanceLog (or a row with the same columns)"""
+        return {
             'id': log.id,
             'device_ip': log.device_ip,
             'user_id': log.user_id,
@@ -111,75 +434,309 @@ class DatabaseManager:
             'status': log.status,
             'synced_to_erpnext': log.synced_to_erpnext,
             'created_at': log.created_at.isoformat()
-        } for log in logs]
+        }
+    
+    @staticmethod
+    def _filter_logs(stmt, device_ip: Optional[str] = None, user_id: Optional[str] = None,
+                     since: Optional[datetime] = None, until: Optional[datetime] = None,
+                     synced: Optional[bool] = None):
+        """Apply the optional /api/logs filters to a select on attendance_logs"""
+        table = AttendanceLog.__table__
+        if device_ip:
+            stmt = stmt.where(table.c.device_ip == device_ip)
+        if user_id:
+            stmt = stmt.where(table.c.user_id == user_id)
+        if since:
+            stmt = stmt.where(table.c.timestamp >= since)
+        if until:
+            stmt = stmt.where(table.c.timestamp < until)
+        if synced is not None:
+            stmt = stmt.where(table.c.synced_to_erpnext == synced)
+        return stmt
+    
+    def query_logs(self, after_id: int = 0, limit: int = 100, **filters) -> List[Dict]:
+        """Get one page of logs with id > after_id, in id order"""
+        table = AttendanceLog.__table__
+        stmt = self._filter_logs(select(table).where(table.c.id > after_id), **filters)
+        stmt = stmt.order_by(table.c.id).limit(limit)
+        with self.engine.connect() as conn:
+            return [self.log_to_dict(row) for row in conn.execute(stmt)]
+    
+    def stream_logs(self, after_id: int = 0, **filters) -> Iterator[Dict]:
+        """Yield matching logs in id order from a server-side cursor
+        
+        Rows are fetched STREAM_PAGE_SIZE at a time, so the full result is
+        never held in memory. The connection stays checked out until the
+        generator is exhausted or closed.
+        """
+        table = AttendanceLog.__table__
+        stmt = self._filter_logs(select(table).where(table.c.id > after_id), **filters)
+        stmt = stmt.order_by(table.c.id)
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(stmt)
+            for rows in result.partitions(STREAM_PAGE_SIZE):
+                for row in rows:
+                    yield self.log_to_dict(row)
 
 # ERPNext API Client
+class SyncError(Exception):
+    """A log could not be pushed; permanent errors are not retried"""
+    
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
 class ERPNextClient:
-    def __init__(self, url: str, api_key: str, api_secret: str):
+    def __init__(self, url: str, api_key: str, api_secret: str,
+                 employee_cache_ttl: int = 300, employee_page_size: int = 1000,
+                 pool_size: int = 10, timeout: float = 30):
         self.url = url.rstrip('/')
         self.api_key = api_key
         self.api_secret = api_secret
+        self.timeout = timeout
         self.session = requests.Session()
+        # Keep one connection per concurrent sync request
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.session.headers.update({
             'Authorization': f'token {api_key}:{api_secret}',
             'Content-Type': 'application/json'
         })
+        self.employee_cache_ttl = employee_cache_ttl
+        self.employee_page_size = employee_page_size
+        self.employee_map: Optional[Dict[str, str]] = None
+        self.employee_map_loaded_at = 0.0
+        self.employee_refresh_failed_at = float('-inf')
+        self.employee_lock = Lock()
+    
+    def request(self, method: str, endpoint: str, path: str, **kwargs) -> requests.Response:
+        """Send one API request, recording its latency and any failure under `endpoint`"""
+        # A hung ERPNext must not hold a sync thread forever
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.url}{path}", **kwargs)
+        except Exception:
+            ERPNEXT_ERRORS.inc(endpoint=endpoint, status='connection')
+            raise
+        finally:
+            ERPNEXT_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        if response.status_code >= 400:
+            ERPNEXT_ERRORS.inc(endpoint=endpoint, status=str(response.status_code))
+        return response
+    
+    def load_employee_map(self, force: bool = False) -> Dict[str, str]:
+        """Fetch the device_user_id -> Employee mapping, cached for employee_cache_ttl seconds
+        
+        Raises a transient SyncError when the mapping cannot be loaded, so
+        logs are retried rather than dead-lettered as having no employee.
+        """
+        with self.employee_lock:
+            if (not force and self.employee_map is not None
+                    and time.monotonic() - self.employee_map_loaded_at < self.employee_cache_ttl):
+                return self.employee_map
+            return self._fetch_employee_map()
+    
+    def expire_employee_map(self):
+        """Reload the mapping on next use, e.g. after employees were fixed in ERPNext"""
+        with self.employee_lock:
+            self.employee_map_loaded_at = float('-inf')
+    
+    def _fetch_employee_map(self) -> Dict[str, str]:
+        employee_map = {}
+        start = 0
+        try:
+            while True:
+                response = self.request(
+                    'GET', 'employees', "/api/resource/Employee",
+                    params={
+                        'fields': json.dumps(['name', 'device_user_id']),
+                        'filters': json.dumps([['device_user_id', 'is', 'set']]),
+                        # A stable order so pages neither overlap nor skip rows
+                        'order_by': 'name asc',
+                        'limit_start': start,
+                        'limit_page_length': self.employee_page_size
+                    }
+                )
+                
+                if response.status_code != 200:
+                    raise SyncError(f"Failed to load employees: HTTP {response.status_code}")
+                
+                employees = response.json().get('data', [])
+                for employee in employees:
+                    employee_map[str(employee['device_user_id'])] = employee['name']
+                
+                if len(employees) < self.employee_page_size:
+                    break
+                start += self.employee_page_size
+                
+        except SyncError:
+            raise
+        except Exception as e:
+            raise SyncError(f"ERPNext API error while loading employees: {e}")
+        
+        self.employee_map = employee_map
+        self.employee_map_loaded_at = time.monotonic()
+        logging.debug(f"Loaded {len(employee_map)} employees from ERPNext")
+        return employee_map
+    
+    def get_employee(self, user_id: str) -> Optional[str]:
+        """Resolve a device user_id to an Employee name from the cached mapping
+        
+        An unknown user_id forces a reload (at most every EMPLOYEE_MISS_REFRESH
+        seconds), so employees added since the last load are found.
+        """
+        employee = self.load_employee_map().get(str(user_id))
+        if employee:
+            return employee
+        with self.employee_lock:
+            now = time.monotonic()
+            if now - self.employee_map_loaded_at >= EMPLOYEE_MISS_REFRESH:
+                # Until a reload succeeds, a miss may just be a stale mapping
+                if now - self.employee_refresh_failed_at < EMPLOYEE_MISS_REFRESH:
+                    raise SyncError(f"Employee list unavailable to resolve device user_id {user_id}")
+                try:
+                    self._fetch_employee_map()
+                except SyncError:
+                    self.employee_refresh_failed_at = now
+                    raise
+            return self.employee_map.get(str(user_id))
     
     def push_attendance(self, user_id: str, timestamp: datetime, status: str, device_ip: str) -> bool:
         """Push attendance to ERPNext"""
         try:
-            # Find employee by device_user_id
-            employee_response = self.session.get(
-                f"{self.url}/api/resource/Employee",
-                params={'filters': json.dumps([['device_user_id', '=', user_id]])}
-            )
-            
-            if employee_response.status_code != 200:
-                logging.warning(f"Failed to find employee for user_id {user_id}")
-                return False
-            
-            employees = employee_response.json().get('data', [])
-            if not employees:
-                logging.warning(f"No employee found for device user_id {user_id}")
-                return False
-            
-            employee = employees[0]['name']
-            
-            # Create Employee Checkin
-            checkin_data = {
-                'employee': employee,
-                'time': timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                'log_type': status,
-                'device_id': device_ip
-            }
-            
-            response = self.session.post(
-                f"{self.url}/api/resource/Employee Checkin",
+            self.create_checkin(user_id, timestamp, status, device_ip)
+            return True
+        except SyncError as e:
+            logging.error(f"Failed to push attendance: {e}")
+            return False
+    
+    @staticmethod
+    def is_duplicate_checkin(response: requests.Response) -> bool:
+        """Whether ERPNext rejected a checkin because the employee already has it"""
+        if response.status_code == 409:
+            return True
+        # HRMS validates duplicates itself and answers 417 with this message
+        return response.status_code == 417 and DUPLICATE_CHECKIN_MESSAGE in response.text
+
+    def create_checkin(self, user_id: str, timestamp: datetime, status: str, device_ip: str):
+        """Create one Employee Checkin, raising SyncError on failure"""
+        # Find employee by device_user_id
+        employee = self.get_employee(user_id)
+        if not employee:
+            raise SyncError(f"No employee found for device user_id {user_id}", permanent=True)
+        
+        checkin_data = {
+            'employee': employee,
+            'time': timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            'log_type': status,
+            'device_id': device_ip
+        }
+        
+        try:
+            response = self.request(
+                'POST', 'checkin', "/api/resource/Employee Checkin",
                 json=checkin_data
             )
+        except Exception as e:
+            raise SyncError(f"ERPNext API error: {e}")
+        
+        if self.is_duplicate_checkin(response):
+            # Already in ERPNext, e.g. pushed before a crash lost our synced flag
+            logging.debug(f"Attendance for {employee} at {checkin_data['time']} already in ERPNext")
+            return
+        
+        if response.status_code not in (200, 201):
+            # Validation errors repeat on every retry; auth, throttling and
+            # server errors are worth retrying later
+            permanent = 400 <= response.status_code < 500 and response.status_code not in (401, 403, 408, 429)
+            raise SyncError(f"HTTP {response.status_code}: {response.text[:200]}", permanent=permanent)
+        
+        logging.debug(f"Successfully pushed attendance for {employee}")
+
+    def push_attendance_batch(self, logs: List[AttendanceLog]) -> Tuple[List[int], Dict[int, str]]:
+        """Push a chunk of logs through the zk_adms bulk endpoint.
+        
+        Returns the ids of logs ERPNext now holds (created or already present)
+        and the errors of rows it rejected, by log id. Raises SyncError if the
+        request itself failed and the chunk should be retried.
+        """
+        checkins = [{
+            'employee': self.get_employee(log.user_id),
+            'user_id': log.user_id,
+            'time': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            'log_type': log.status,
+            'device_id': log.device_ip
+        } for log in logs]
+        
+        try:
+            response = self.request(
+                'POST', 'bulk_checkin', "/api/method/zk_adms.api.bulk_employee_checkin",
+                json={'checkins': checkins}
+            )
             
-            if response.status_code in [200, 201]:
-                logging.info(f"Successfully pushed attendance for {employee}")
-                return True
-            else:
-                logging.error(f"Failed to push attendance: {response.text}")
-                return False
-                
+            if response.status_code != 200:
+                raise SyncError(f"HTTP {response.status_code}: {response.text[:200]}")
+            
+            results = response.json().get('message', [])
+        except SyncError:
+            raise
         except Exception as e:
-            logging.error(f"ERPNext API error: {e}")
-            return False
+            raise SyncError(f"ERPNext API error: {e}")
+        
+        synced_ids = []
+        failed = {}
+        for log, result in zip(logs, results):
+            if result and result.get('status') in ('Created', 'Duplicate'):
+                synced_ids.append(log.id)
+            else:
+                failed[log.id] = (result or {}).get('error') or 'No result returned'
+        
+        return synced_ids, failed
 
 # Device Manager
+def zklib_connection(device: Dict) -> object:
+    """Default device transport: a zklib client for the device (UDP port 4370)"""
+    # Imported on first use, so push-only setups and fake transports run without zklib
+    from zklib import zklib
+    conn = zklib.ZKLib(device['ip'], device.get('port', 4370))
+    if device.get('timeout'):
+        conn.zkclient.settimeout(device['timeout'])
+    return conn
+
 class DeviceManager:
-    def __init__(self, devices: List[Dict], db_manager: DatabaseManager):
+    """Polls devices over a pluggable transport
+    
+    connection_factory(device) returns an unconnected client with the zklib
+    interface: connect() -> bool, disable_device(), get_attendance() ->
+    [(user_id, timestamp, status), ...], clear_attendance(), enable_device()
+    and disconnect(). The device dict it gets carries 'timeout', the
+    seconds to wait for each reply, so a silent device fails its poll
+    instead of holding a thread. The default talks to real terminals
+    through zklib; benchmarks/fake_device.py provides an in-memory one.
+    """
+    
+    def __init__(self, devices: List[Dict], db_manager: DatabaseManager,
+                 concurrency: int = 8, timeout: int = 60, clear_buffer: bool = False,
+                 connection_factory: Callable[[Dict], object] = zklib_connection,
+                 socket_timeout: float = 5):
         self.devices = devices
         self.db_manager = db_manager
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.clear_buffer = clear_buffer
+        self.connection_factory = connection_factory
+        self.socket_timeout = socket_timeout
         self.connections = {}
+        # Polls by device IP, kept across cycles while they run
+        self.in_flight: Dict[str, Future] = {}
+        self.in_flight_lock = Lock()
     
     def connect_device(self, device: Dict) -> Optional[object]:
         """Connect to a ZKTeco device"""
         try:
-            conn = zklib.ZKLib(device['ip'], device.get('port', 4370))
+            conn = self.connection_factory({'timeout': self.socket_timeout, **device})
             if conn.connect():
                 logging.info(f"Connected to device {device['ip']}")
                 return conn
@@ -190,10 +747,27 @@ class DeviceManager:
             logging.error(f"Failed to connect to {device['ip']}: {e}")
             return None
     
-    def fetch_attendance_logs(self, device: Dict) -> List[Dict]:
-        """Fetch attendance logs from device"""
+    def fetch_attendance_logs(self, device: Dict,
+                              on_logs: Optional[Callable[[Dict, List[Dict]], None]] = None) -> List[Dict]:
+        """Fetch attendance logs from device
+        
+        Only records at or after the device watermark are returned, unless
+        clear_buffer is set: the buffer is then about to be wiped, so every
+        record it holds is returned, including punches stamped before the
+        watermark after the device clock was set back. If given,
+        on_logs(device, logs) is called from the polling thread as soon as
+        this device's logs have been read, while the device is still
+        disabled; with clear_buffer set the device buffer is cleared only
+        after on_logs has returned.
+        """
+        with DEVICE_POLL_SECONDS.time(device=device['ip']):
+            return self._fetch_attendance_logs(device, on_logs)
+    
+    def _fetch_attendance_logs(self, device: Dict,
+                               on_logs: Optional[Callable[[Dict, List[Dict]], None]]) -> List[Dict]:
         conn = self.connect_device(device)
         if not conn:
+            DEVICE_POLL_ERRORS.inc(device=device['ip'])
             return []
         
         try:
@@ -204,8 +778,19 @@ class DeviceManager:
             attendances = conn.get_attendance()
             logs = []
             
+            # Records older than the watermark are already stored; records at
+            # the watermark are kept and deduplicated by the unique constraint.
+            # A buffer that is cleared after this read holds only unstored
+            # records whatever their timestamps, so nothing is skipped.
+            watermark = None
+            if self.db_manager and not (self.clear_buffer and on_logs):
+                watermark = self.db_manager.get_watermark(device['ip'])
+            
             if attendances:
                 for att in attendances:
+                    if watermark and att[1] < watermark:
+                        continue
+                    
                     # Parse attendance data based on zklib format
                     logs.append({
                         'device_ip': device['ip'],
@@ -214,6 +799,13 @@ class DeviceManager:
                         'status': 'IN' if att[2] == 1 else 'OUT'  # Status
                     })
             
+            if on_logs and logs:
+                on_logs(device, logs)
+            
+            if self.clear_buffer and on_logs and attendances:
+                conn.clear_attendance()
+                logging.info(f"Cleared attendance buffer on {device['ip']}")
+            
             # Enable device after data transfer
             conn.enable_device()
             conn.disconnect()
@@ -222,6 +814,7 @@ class DeviceManager:
             
         except Exception as e:
             logging.error(f"Error fetching logs from {device['ip']}: {e}")
+            DEVICE_POLL_ERRORS.inc(device=device['ip'])
             if conn:
                 try:
                     conn.enable_device()
@@ -230,26 +823,85 @@ class DeviceManager:
                     pass
             return []
     
-    def fetch_all_devices(self) -> List[Dict]:
-        """Fetch logs from all devices"""
+    def fetch_all_devices(self, on_logs: Optional[Callable[[Dict, List[Dict]], None]] = None) -> List[Dict]:
+        """Fetch logs from all devices, polling up to `concurrency` devices at once
+        
+        A device still running after `timeout` seconds is abandoned for this
+        cycle so it cannot hold up the others, and is skipped by later cycles
+        until that poll has finished, so a hung device never has more than
+        one connection open.
+        """
         all_logs = []
-        for device in self.devices:
-            logs = self.fetch_attendance_logs(device)
-            all_logs.extend(logs)
+        started = {}
+        
+        def poll(index: int, device: Dict) -> List[Dict]:
+            started[index] = time.monotonic()
+            return self.fetch_attendance_logs(device, on_logs)
+        
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='device-poll')
+        pending = {}
+        with self.in_flight_lock:
+            for index, device in enumerate(self.devices):
+                previous = self.in_flight.get(device['ip'])
+                if previous and not previous.done():
+                    logging.warning(f"Device {device['ip']} is still busy with an earlier poll, skipping")
+                    continue
+                future = executor.submit(poll, index, device)
+                self.in_flight[device['ip']] = future
+                pending[future] = (index, device)
+        
+        try:
+            while pending:
+                done, _ = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, device = pending.pop(future)
+                    try:
+                        all_logs.extend(future.result())
+                    except Exception as e:
+                        logging.error(f"Error polling device {device['ip']}: {e}")
+                
+                now = time.monotonic()
+                for future, (index, device) in list(pending.items()):
+                    if index in started and now - started[index] > self.timeout:
+                        logging.error(f"Device {device['ip']} timed out after {self.timeout}s")
+                        pending.pop(future)
+        finally:
+            # Abandoned polls finish (or fail) in the background
+            executor.shutdown(wait=False)
+        
         return all_logs
 
 # Main ADMS Server
 class ADMSServer:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, connection_factory: Callable[[Dict], object] = zklib_connection):
         self.config = config
         self.db_manager = DatabaseManager(config.DATABASE_URL)
         self.erpnext_client = ERPNextClient(
             config.ERPNEXT_URL, 
             config.ERPNEXT_API_KEY, 
-            config.ERPNEXT_API_SECRET
+            config.ERPNEXT_API_SECRET,
+            config.EMPLOYEE_CACHE_TTL,
+            config.EMPLOYEE_PAGE_SIZE,
+            config.SYNC_CONCURRENCY,
+            config.ERPNEXT_TIMEOUT
         ) if config.ERPNEXT_API_KEY else None
-        self.device_manager = DeviceManager(config.DEVICES or [], self.db_manager)
+        self.device_manager = DeviceManager(
+            config.DEVICES or [],
+            self.db_manager,
+            config.POLL_CONCURRENCY,
+            config.DEVICE_TIMEOUT,
+            config.CLEAR_DEVICE_BUFFER,
+            connection_factory,
+            config.DEVICE_SOCKET_TIMEOUT
+        )
         self.running = False
+        self.sync_stalled = False
+        self.stop_event = Event()
+        # Set when new logs are stored, so the sync worker picks them up early
+        self.sync_wakeup = Event()
+        self.sync_executor = ThreadPoolExecutor(
+            max(1, config.SYNC_CONCURRENCY), thread_name_prefix='erpnext-sync'
+        )
         
         # Setup logging
         logging.basicConfig(
@@ -263,53 +915,211 @@ class ADMSServer:
     
     def fetch_and_store_logs(self):
         """Fetch logs from devices and store in database"""
-        logs = self.device_manager.fetch_all_devices()
         new_count = 0
+        count_lock = Lock()
         
-        for log in logs:
-            if self.db_manager.add_log(
-                log['device_ip'], 
-                log['user_id'], 
-                log['timestamp'], 
-                log['status']
-            ):
-                new_count += 1
+        def store(device: Dict, logs: List[Dict]):
+            nonlocal new_count
+            stored = self.store_logs(logs)
+            RECORDS_PARSED.inc(len(logs), device=device['ip'])
+            RECORDS_INSERTED.inc(stored, device=device['ip'])
+            RECORDS_DUPLICATE.inc(len(logs) - stored, device=device['ip'])
+            with count_lock:
+                new_count += stored
+        
+        # Each device's logs are stored as soon as that device finishes
+        self.device_manager.fetch_all_devices(on_logs=store)
         
         if new_count > 0:
             logging.info(f"Stored {new_count} new attendance logs")
         
         return new_count
     
-    def sync_to_erpnext(self):
-        """Sync unsynced logs to ERPNext"""
+    def store_logs(self, logs: List[Dict]) -> int:
+        """Store fetched logs and advance device watermarks, return the number of new records"""
+        new_count = self.db_manager.add_logs_bulk(logs)
+        watermarks = {}
+        
+        for log in logs:
+            device_ip = log['device_ip']
+            if device_ip not in watermarks or log['timestamp'] > watermarks[device_ip]:
+                watermarks[device_ip] = log['timestamp']
+        
+        for device_ip, timestamp in watermarks.items():
+            self.db_manager.set_watermark(device_ip, timestamp)
+        
+        if new_count > 0:
+            self.sync_wakeup.set()
+        return new_count
+    
+    def push_device_ip(self, serial_number: str) -> str:
+        """Device key for pushed logs: the configured IP for this serial number, else the serial number
+        
+        Keying pushed logs like polled ones keeps duplicate detection working
+        for a device that is switched from pull to push. Other devices are
+        keyed by serial number rather than by the sender's address, which
+        devices behind one NAT share and DHCP may change.
+        """
+        for device in self.config.DEVICES or []:
+            if device.get('serial_number') == serial_number:
+                return device['ip']
+        return serial_number
+    
+    def store_pushed_logs(self, device_ip: str, table: str, lines: Iterator[str]) -> int:
+        """Store the attendance records of a pushed upload, return the number of new records
+        
+        Records are written through add_logs_bulk in chunks as they are
+        parsed, so a large backlog upload is never held in memory at once.
+        """
+        batch = []
+        parsed = 0
+        new_count = 0
+        
+        for kind, record in parse_upload(table, lines):
+            if kind != 'attendance':
+                continue
+            parsed += 1
+            batch.append({
+                'device_ip': device_ip,
+                'user_id': record['user_id'],
+                'timestamp': record['timestamp'],
+                'status': record['punch_type']
+            })
+            if len(batch) >= BULK_INSERT_CHUNK:
+                new_count += self.db_manager.add_logs_bulk(batch)
+                batch = []
+        
+        new_count += self.db_manager.add_logs_bulk(batch)
+        RECORDS_PARSED.inc(parsed, device=device_ip)
+        RECORDS_INSERTED.inc(new_count, device=device_ip)
+        RECORDS_DUPLICATE.inc(parsed - new_count, device=device_ip)
+        if new_count > 0:
+            logging.info(f"Stored {new_count} new attendance logs pushed from {device_ip}")
+            self.sync_wakeup.set()
+        return new_count
+    
+    def get_handshake_response(self, serial_number: str) -> str:
+        """Reply to the GET cdata?options=all handshake of a pushing device"""
+        options = dict(PUSH_DEVICE_OPTIONS)
+        options.update(self.config.PUSH_DEVICE_OPTIONS or {})
+        stamps = self.db_manager.get_stamps(serial_number)
+        
+        lines = [f"GET OPTION FROM: {serial_number}"]
+        lines.extend(f"{table}Stamp={stamps[table] or 'None'}" for table in PUSH_STAMP_TABLES)
+        lines.extend(f"{key}={value}" for key, value in options.items())
+        return "\n".join(lines) + "\n"
+    
+    def sync_to_erpnext(self) -> int:
+        """Push due logs from the outbox to ERPNext, return the number synced
+        
+        Each page of due logs is split into work items (single logs, or
+        chunks of SYNC_BATCH_SIZE) that run on the sync executor, so at most
+        SYNC_CONCURRENCY requests are in flight. Failed logs are rescheduled
+        with exponential backoff or, for permanent failures, dead-lettered.
+        The scan stops early when a whole page fails transiently, since
+        ERPNext is then most likely down.
+        """
+        self.sync_stalled = False
         if not self.erpnext_client:
             return 0
         
-        unsynced_logs = self.db_manager.get_unsynced_logs()
         synced_count = 0
+        batch_size = max(self.config.SYNC_BATCH_SIZE, 1)
+        page_size = max(UNSYNCED_PAGE_SIZE, batch_size)
         
-        for log in unsynced_logs:
-            for attempt in range(self.config.RETRY_ATTEMPTS):
-                if self.erpnext_client.push_attendance(
-                    log.user_id, 
-                    log.timestamp, 
-                    log.status, 
-                    log.device_ip
-                ):
-                    self.db_manager.mark_synced(log.id)
-                    synced_count += 1
+        for index, page in enumerate(self.db_manager.iter_due_logs(page_size)):
+            # One Employee query per cycle (at most), refreshed once the TTL expires
+            if index == 0:
+                try:
+                    self.erpnext_client.load_employee_map()
+                except SyncError as e:
+                    # ERPNext is most likely down; leave the logs due and back off
+                    logging.error(f"Sync skipped: {e}")
+                    self.sync_stalled = True
                     break
-                else:
-                    if attempt < self.config.RETRY_ATTEMPTS - 1:
-                        time.sleep(self.config.RETRY_DELAY)
+            
+            logs = [log for log, _ in page]
+            attempts = {log.id: count for log, count in page}
+            items = [logs[start:start + batch_size] for start in range(0, len(logs), batch_size)]
+            
+            synced_ids = []
+            failures = []
+            for item_synced, item_failures in self.sync_executor.map(self.push_logs, items):
+                synced_ids.extend(item_synced)
+                failures.extend(item_failures)
+            
+            self.db_manager.mark_synced_bulk(synced_ids)
+            self.db_manager.record_sync_failures([
+                self.next_attempt(log_id, attempts[log_id] + 1, error, permanent)
+                for log_id, error, permanent in failures
+            ])
+            synced_count += len(synced_ids)
+            
+            if not synced_ids and not all(permanent for _, _, permanent in failures):
+                self.sync_stalled = True
+                break
         
         if synced_count > 0:
             logging.info(f"Synced {synced_count} logs to ERPNext")
         
         return synced_count
     
+    def push_logs(self, logs: List[AttendanceLog]) -> Tuple[List[int], List[Tuple[int, str, bool]]]:
+        """Push one work item, return synced ids and (log id, error, permanent) failures"""
+        if self.config.SYNC_BATCH_SIZE > 0:
+            try:
+                synced_ids, failed = self.erpnext_client.push_attendance_batch(logs)
+            except SyncError as e:
+                return [], [(log.id, str(e), e.permanent) for log in logs]
+            # Rows the bulk endpoint rejected (no employee, bad data) fail the same way on retry
+            return synced_ids, [(log_id, error, True) for log_id, error in failed.items()]
+        
+        log = logs[0]
+        try:
+            self.erpnext_client.create_checkin(log.user_id, log.timestamp, log.status, log.device_ip)
+        except SyncError as e:
+            return [], [(log.id, str(e), e.permanent)]
+        return [log.id], []
+    
+    def next_attempt(self, log_id: int, attempts: int, error: str, permanent: bool) -> Dict:
+        """Retry state for a failed log: exponential backoff with jitter, or dead letter"""
+        if permanent:
+            logging.warning(f"Log {log_id} dead-lettered: {error}")
+        delay = min(self.config.RETRY_DELAY * 2 ** (attempts - 1), self.config.SYNC_MAX_BACKOFF)
+        return {
+            'log_id': log_id,
+            'attempts': attempts,
+            'next_attempt_at': datetime.now() + timedelta(seconds=delay * random.uniform(0.8, 1.2)),
+            'last_error': error[:255],
+            'dead': permanent
+        }
+    
+    def sync_loop(self):
+        """Sync worker: drain the outbox when logs arrive or every SYNC_INTERVAL"""
+        backoff = 0
+        while self.running:
+            if backoff:
+                # ERPNext looks down; new logs wait in the outbox meanwhile
+                self.stop_event.wait(backoff)
+            else:
+                self.sync_wakeup.wait(self.config.SYNC_INTERVAL)
+            self.sync_wakeup.clear()
+            if not self.running:
+                break
+            
+            try:
+                self.sync_to_erpnext()
+            except Exception as e:
+                logging.error(f"Error in sync worker: {e}")
+                self.sync_stalled = True
+            
+            if self.sync_stalled:
+                backoff = min(max(backoff * 2, self.config.RETRY_DELAY), self.config.SYNC_MAX_BACKOFF)
+            else:
+                backoff = 0
+    
     def run_cycle(self):
-        """Run one complete cycle"""
+        """Run one complete cycle (fetch, then sync) in the calling thread"""
         try:
             new_logs = self.fetch_and_store_logs()
             synced_logs = self.sync_to_erpnext()
@@ -318,23 +1128,93 @@ class ADMSServer:
             logging.error(f"Error in cycle: {e}")
     
     def start(self):
-        """Start the ADMS server"""
+        """Start the ADMS server: the polling loop here, the sync worker in its own thread"""
         self.running = True
+        self.stop_event.clear()
         logging.info("ADMS Server started")
         
+        sync_thread = Thread(target=self.sync_loop, name='sync-worker', daemon=True)
+        sync_thread.start()
+        
         while self.running:
-            self.run_cycle()
-            time.sleep(self.config.POLL_INTERVAL)
+            try:
+                new_logs = self.fetch_and_store_logs()
+                logging.debug(f"Poll complete: {new_logs} new")
+            except Exception as e:
+                logging.error(f"Error in polling loop: {e}")
+            self.stop_event.wait(self.config.POLL_INTERVAL)
     
     def stop(self):
         """Stop the ADMS server"""
         self.running = False
+        self.stop_event.set()
+        self.sync_wakeup.set()
         logging.info("ADMS Server stopped")
 
 # Flask API
+LOGS_PAGE_SIZE = 100
+LOGS_PAGE_MAX = 1000
+LOG_FIELDS = ['id', 'device_ip', 'user_id', 'timestamp', 'status', 'synced_to_erpnext', 'created_at']
+
+def parse_datetime_arg(name: str) -> Optional[datetime]:
+    """Parse an optional ISO datetime query parameter"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {value}")
+
+def parse_bool_arg(name: str) -> Optional[bool]:
+    """Parse an optional true/false query parameter"""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"Invalid {name}: {value}")
+
+def iter_csv(rows: Iterator[Dict]) -> Iterator[str]:
+    """Render log dicts as CSV, one line at a time"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=LOG_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
 def create_flask_app(adms_server: ADMSServer) -> Flask:
     app = Flask(__name__)
     
+    # Backlog gauges read from this server's database at scrape time
+    backlog_metrics = Registry()
+    backlog_metrics.gauge(
+        'zk_adms_sync_backlog', 'Logs not yet synced to ERPNext', adms_server.db_manager.count_unsynced
+    )
+    backlog_metrics.gauge(
+        'zk_adms_sync_dead_letters', 'Logs that failed permanently', adms_server.db_manager.count_dead_letters
+    )
+    
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+    
+    @app.after_request
+    def observe_iclock_request(response: Response) -> Response:
+        if request.path.startswith('/iclock/'):
+            ICLOCK_REQUEST_SECONDS.observe(
+                time.perf_counter() - g.request_started,
+                endpoint=request.path.rstrip('/').rsplit('/', 1)[-1],
+                table=request.args.get('table', '').upper()
+            )
+        return response
+    
     @app.route('/api/fetch', methods=['POST'])
     def manual_fetch():
         """Manually trigger fetch from all devices"""
@@ -351,24 +1231,121 @@ def create_flask_app(adms_server: ADMSServer) -> Flask:
     
     @app.route('/api/logs', methods=['GET'])
     def get_logs():
-        """Get all stored logs"""
+        """Get stored logs, one page at a time or as a streamed export
+        
+        Query parameters: after_id, limit, device_ip, user_id, since, until
+        (ISO timestamps), synced (true/false) and format (json, ndjson, csv).
+        """
         try:
-            logs = adms_server.db_manager.get_all_logs()
-            return jsonify({'success': True, 'logs': logs})
+            after_id = request.args.get('after_id', 0, type=int)
+            limit = min(max(request.args.get('limit', LOGS_PAGE_SIZE, type=int), 1), LOGS_PAGE_MAX)
+            filters = {
+                'device_ip': request.args.get('device_ip'),
+                'user_id': request.args.get('user_id'),
+                'since': parse_datetime_arg('since'),
+                'until': parse_datetime_arg('until'),
+                'synced': parse_bool_arg('synced')
+            }
+            output_format = request.args.get('format', 'json')
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        try:
+            if output_format == 'ndjson':
+                rows = adms_server.db_manager.stream_logs(after_id, **filters)
+                return Response(
+                    stream_with_context(json.dumps(row) + '\n' for row in rows),
+                    mimetype='application/x-ndjson'
+                )
+            
+            if output_format == 'csv':
+                rows = adms_server.db_manager.stream_logs(after_id, **filters)
+                return Response(
+                    stream_with_context(iter_csv(rows)),
+                    mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=attendance_logs.csv'}
+                )
+            
+            logs = adms_server.db_manager.query_logs(after_id, limit, **filters)
+            return jsonify({
+                'success': True,
+                'logs': logs,
+                'next_after_id': logs[-1]['id'] if len(logs) == limit else None
+            })
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
     
+    def text_response(body: str, status: int = 200) -> Response:
+        return Response(body, status=status, mimetype='text/plain')
+    
+    @app.route('/iclock/cdata', methods=['GET', 'POST'])
+    def iclock_cdata():
+        """ADMS push: handshake (GET ?options=all) and uploads (POST ?table=...)"""
+        serial_number = request.args.get('SN')
+        if not serial_number:
+            return text_response("ERROR: No SN provided", 400)
+        
+        try:
+            if request.method == 'GET':
+                if request.args.get('options'):
+                    return text_response(adms_server.get_handshake_response(serial_number))
+                return text_response("OK")
+            
+            table = request.args.get('table', 'ATTLOG').upper()
+            device_ip = adms_server.push_device_ip(serial_number)
+            # Read the body line by line straight from the request stream
+            adms_server.store_pushed_logs(device_ip, table, iter_lines(request.stream))
+            
+            # Stamp only once stored, so a failed upload is resent
+            stamp = request.args.get('Stamp')
+            if stamp and table in PUSH_STAMP_TABLES:
+                adms_server.db_manager.set_stamp(serial_number, table, stamp)
+            return text_response("OK")
+        except Exception as e:
+            logging.error(f"Push error from {serial_number}: {e}")
+            return text_response("ERROR", 500)
+    
+    @app.route('/iclock/getrequest', methods=['GET'])
+    def iclock_getrequest():
+        """ADMS push: command poll; there is no command queue here"""
+        return text_response("OK")
+    
+    @app.route('/iclock/devicecmd', methods=['POST'])
+    def iclock_devicecmd():
+        """ADMS push: command results"""
+        logging.debug(f"Command result from {request.args.get('SN')}: {request.get_data(as_text=True)}")
+        return text_response("OK")
+    
     @app.route('/api/status', methods=['GET'])
     def get_status():
         """Get server status"""
-        unsynced_count = len(adms_server.db_manager.get_unsynced_logs())
+        unsynced_count = adms_server.db_manager.count_unsynced()
         return jsonify({
             'success': True,
             'running': adms_server.running,
             'devices_configured': len(adms_server.config.DEVICES or []),
-            'unsynced_logs': unsynced_count
+            'unsynced_logs': unsynced_count,
+            'dead_letter_logs': adms_server.db_manager.count_dead_letters()
         })
     
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """Prometheus scrape endpoint"""
+        return Response(
+            METRICS.render() + backlog_metrics.render(),
+            mimetype='text/plain; version=0.0.4'
+        )
+    
+    @app.route('/api/sync/retry', methods=['POST'])
+    def retry_dead_letters():
+        """Retry dead-lettered logs, e.g. after fixing employee mappings"""
+        requeued = adms_server.db_manager.requeue_dead_letters()
+        if adms_server.erpnext_client:
+            # Most dead letters are user_ids the cached mapping lacked
+            adms_server.erpnext_client.expire_employee_map()
+        adms_server.sync_wakeup.set()
+        return jsonify({'success': True, 'requeued': requeued})
+    
     return app
 
 # Configuration loader
@@ -383,8 +1360,8 @@ def load_config(config_file: str = "adms_config.json") -> Config:
                 if hasattr(config, key):
                     setattr(config, key, value)
     
-    # Default devices if none configured
-    if not config.DEVICES:
+    # Default devices if none configured; an empty list means push only
+    if config.DEVICES is None:
         config.DEVICES = [
             {"ip": "192.168.1.201", "port": 4370},
             {"ip": "192.168.1.202", "port": 4370},
@@ -410,7 +1387,7 @@ def main():
     if args.api_only:
         # Run only Flask API
         app = create_flask_app(adms_server)
-        app.run(host='0.0.0.0', port=5000, debug=False)
+        app.run(host='0.0.0.0', port=config.API_PORT, debug=False, threaded=True)
     else:
         # Run main server with optional API
         if args.daemon:
@@ -420,7 +1397,7 @@ def main():
             
             # Start Flask API in main thread
             app = create_flask_app(adms_server)
-            app.run(host='0.0.0.0', port=5000, debug=False)
+            app.run(host='0.0.0.0', port=config.API_PORT, debug=False, threaded=True)
         else:
             # Run main server only
             try:
@@ -0,0 +1,105 @@
+"""
+Synthetic ATTLOG uploads for benchmarks and load tests
+
+Uploads are generated deterministically from a seed: every user punches in
+and out each day on one device, each device's punches are cut into uploads
+of `upload_size` records, and a share of each upload is made of records the
+device already sent (as a device does when it resends its buffer).
+"""
+
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterator, List
+
+START_DATE = datetime(2024, 1, 1)
+
+# Punch state codes (see zk_adms.parser.PUNCH_STATUS) and verify modes
+CHECK_IN = 0
+CHECK_OUT = 1
+VERIFY_MODES = (1, 4, 15)  # fingerprint, card, face
+
+@dataclass
+class Upload:
+    serial_number: str
+    device_ip: str
+    body: str
+    records: int  # lines in the body
+    duplicates: int  # lines already sent in an earlier upload
+
+def device_serial(index: int) -> str:
+    return f"BENCH{index:04d}"
+
+def device_ip(index: int) -> str:
+    return f"10.0.{index // 250}.{index % 250 + 1}"
+
+def attlog_line(user_id: int, timestamp: datetime, status: int, verify: int) -> str:
+    return f"{user_id}\t{timestamp:%Y-%m-%d %H:%M:%S}\t{status}\t{verify}\t0\t0\t0"
+
+def device_user_ids(index: int, users: int, devices: int) -> List[int]:
+    """Users enrolled on a device; every user punches on exactly one device"""
+    return list(range(index + 1, users + 1, devices))
+
+def generate_punches(rng: random.Random, user_ids: List[int], days: int) -> List[tuple]:
+    """One check-in and one check-out per user per day as (timestamp, user_id, status, verify), in time order"""
+    punches = []
+    for day in range(days):
+        date = START_DATE + timedelta(days=day)
+        for user_id in user_ids:
+            verify = rng.choice(VERIFY_MODES)
+            punch_in = date + timedelta(hours=8, seconds=rng.randrange(2 * 3600))
+            punch_out = date + timedelta(hours=16, seconds=rng.randrange(3 * 3600))
+            punches.append((punch_in, user_id, CHECK_IN, verify))
+            punches.append((punch_out, user_id, CHECK_OUT, verify))
+    punches.sort()
+    return punches
+
+def device_punches(rng: random.Random, user_ids: List[int], days: int) -> List[str]:
+    """ATTLOG lines for generate_punches"""
+    return [
+        attlog_line(user_id, timestamp, status, verify)
+        for timestamp, user_id, status, verify in generate_punches(rng, user_ids, days)
+    ]
+
+def generate_uploads(users: int = 500, devices: int = 10, days: int = 5, duplicate_ratio: float = 0.1,
+                     upload_size: int = 50, seed: int = 1) -> List[Upload]:
+    """Uploads of all devices, interleaved in the order devices would send them
+
+    duplicate_ratio is the share of all uploaded lines that repeat a line
+    the same device sent before (0 for none, must be below 1).
+    """
+    if not 0 <= duplicate_ratio < 1:
+        raise ValueError("duplicate_ratio must be at least 0 and below 1")
+
+    rng = random.Random(seed)
+    per_device = []
+    for index in range(devices):
+        user_ids = device_user_ids(index, users, devices)
+        sent = []
+        uploads = []
+        punches = device_punches(rng, user_ids, days)
+        for start in range(0, len(punches), upload_size):
+            lines = punches[start:start + upload_size]
+            resent = min(len(sent), round(len(lines) * duplicate_ratio / (1 - duplicate_ratio)))
+            duplicates = rng.sample(sent, resent) if resent else []
+            sent.extend(lines)
+            body_lines = duplicates + lines
+            uploads.append(Upload(
+                serial_number=device_serial(index),
+                device_ip=device_ip(index),
+                body="\n".join(body_lines) + "\n",
+                records=len(body_lines),
+                duplicates=len(duplicates)
+            ))
+        per_device.append(uploads)
+
+    # Round-robin across devices, as concurrent devices would arrive
+    interleaved = []
+    for position in range(max((len(uploads) for uploads in per_device), default=0)):
+        interleaved.extend(uploads[position] for uploads in per_device if position < len(uploads))
+    return interleaved
+
+def iter_employees(users: int) -> Iterator[dict]:
+    """Employee rows matching the generated user ids"""
+    for user_id in range(1, users + 1):
+        yield {'name': f"HR-EMP-{user_id:05d}", 'device_user_id': str(user_id)}
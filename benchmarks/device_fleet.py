@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Simulated fleet of ZKTeco devices in ADMS push mode, for load testing
+
+Each simulated device runs in its own thread and talks to the iclock
+endpoint the way a terminal does: the cdata?options=all handshake, a
+getrequest poll every Delay seconds, and an ATTLOG upload every
+TransInterval minutes (both taken from the handshake reply). Uploads come
+from the synthetic workload in benchmarks/attlog.py, including resent
+lines. Works against the Frappe app, adms_server.py or zk_proxy_server.py.
+
+--speed compresses time: with --speed 60 a one-minute TransInterval passes
+in one second. --outage-at/--outage-for silence all devices for a while;
+they then reconnect at the same moment and send everything they held back
+(a reconnect storm). --backlog-uploads makes every device start with one
+large dump, like terminals that were offline for days.
+
+Usage:
+    python benchmarks/device_fleet.py http://localhost:8000 --devices 200 --duration 120 --speed 60
+    python benchmarks/device_fleet.py http://localhost:8080 --devices 500 --outage-at 30 --outage-for 20
+
+With --erpnext-url and an API key, Employee Checkins in the workload's
+date range are counted afterwards and duplicate (employee, time) pairs
+reported; checkins are only made for users mapped to an Employee
+(Attendance Device ID 1..--users).
+"""
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, List, Optional
+from urllib.parse import urlencode, urlparse
+
+# Run from a checkout: make the benchmarks package importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.attlog import START_DATE, Upload, generate_uploads
+from benchmarks.run import percentile
+
+# Used until the handshake reply says otherwise (ADMS defaults)
+DEFAULT_OPTIONS = {'Delay': 10, 'TransInterval': 1, 'ErrorDelay': 30}
+FIRST_STAMP = 1000
+
+class Stats:
+    """Thread-safe request outcomes by request kind"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.records_sent = 0
+        self.duplicates_sent = 0
+        self.records_acknowledged = 0
+
+    def record(self, kind: str, seconds: float, ok: bool, upload: Optional[Upload] = None):
+        with self.lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+            if not ok:
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+            if upload:
+                self.records_sent += upload.records
+                self.duplicates_sent += upload.duplicates
+                if ok:
+                    self.records_acknowledged += upload.records
+
+    def summary(self, elapsed: float) -> Dict:
+        with self.lock:
+            kinds = {}
+            for kind, latencies in sorted(self.latencies.items()):
+                errors = self.errors.get(kind, 0)
+                kinds[kind] = {
+                    'requests': len(latencies),
+                    'errors': errors,
+                    'error_rate': round(errors / len(latencies), 4),
+                    'per_sec': round(len(latencies) / elapsed, 2),
+                    'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+                    'p90_ms': round(percentile(latencies, 0.90) * 1000, 1),
+                    'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+                    'max_ms': round(max(latencies) * 1000, 1)
+                }
+            return {
+                'elapsed': round(elapsed, 1),
+                'requests': kinds,
+                'records_sent': self.records_sent,
+                'duplicates_sent': self.duplicates_sent,
+                'records_acknowledged': self.records_acknowledged,
+                'records_per_sec': round(self.records_acknowledged / elapsed, 1)
+            }
+
+class SimulatedDevice(threading.Thread):
+    def __init__(self, serial_number: str, uploads: List[Upload], fleet: 'Fleet'):
+        super().__init__(name=f"device-{serial_number}", daemon=True)
+        self.serial_number = serial_number
+        self.fleet = fleet
+        self.options = dict(DEFAULT_OPTIONS)
+        self.stamp = FIRST_STAMP
+        self.next_upload: Optional[float] = None  # monotonic time the next upload is due
+        self.connection: Optional[http.client.HTTPConnection] = None
+
+        # The first backlog_uploads uploads are sent as one dump on startup
+        backlog = uploads[:fleet.args.backlog_uploads]
+        self.backlog = Upload(
+            serial_number, backlog[0].device_ip, ''.join(upload.body for upload in backlog),
+            sum(upload.records for upload in backlog), sum(upload.duplicates for upload in backlog)
+        ) if backlog else None
+        self.pending = uploads[len(backlog):]
+
+    def request(self, kind: str, method: str, path: str, params: Dict, upload: Optional[Upload] = None) -> Optional[str]:
+        """Send one request on the device's keep-alive connection; None on failure"""
+        query = urlencode(dict(params, SN=self.serial_number))
+        body = upload.body.encode() if upload else None
+        headers = dict(self.fleet.headers)
+        if body is not None:
+            headers['Content-Type'] = 'text/plain'
+
+        started = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = self.fleet.connect()
+            self.connection.request(method, f"{self.fleet.base_path}/iclock/{path}?{query}", body, headers)
+            response = self.connection.getresponse()
+            text = response.read().decode('utf-8', 'replace')
+            ok = response.status == 200 and not text.startswith('ERROR')
+        except (OSError, http.client.HTTPException):
+            self.disconnect()
+            text, ok = None, False
+        self.fleet.stats.record(kind, time.perf_counter() - started, ok, upload)
+        return text if ok else None
+
+    def disconnect(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def handshake(self) -> bool:
+        reply = self.request('handshake', 'GET', 'cdata', {'options': 'all', 'pushver': '2.4.1', 'language': '69'})
+        if reply is None:
+            return False
+        for line in reply.splitlines():
+            key, sep, value = line.partition('=')
+            if sep and key in DEFAULT_OPTIONS:
+                try:
+                    self.options[key] = float(value)
+                except ValueError:
+                    pass
+        return True
+
+    def send_upload(self, upload: Upload, kind: str = 'cdata') -> bool:
+        params = {'table': 'ATTLOG', 'Stamp': str(self.stamp)}
+        if self.request(kind, 'POST', 'cdata', params, upload) is None:
+            return False
+        self.stamp += 1
+        return True
+
+    def wait(self, seconds: float) -> bool:
+        """Sleep in simulated seconds; False once the run is over"""
+        return not self.fleet.stop_event.wait(seconds / self.fleet.args.speed)
+
+    def wait_out_outage(self):
+        """Go silent during the outage window, then reconnect with the rest of the fleet"""
+        if self.fleet.in_outage():
+            self.disconnect()
+            self.fleet.outage_over.wait()
+            self.connect_and_flush()
+
+    def upload_due(self) -> bool:
+        return bool(self.pending) and time.monotonic() >= self.next_upload
+
+    def send_next_upload(self) -> bool:
+        if not self.send_upload(self.pending[0]):
+            return False
+        self.pending.pop(0)
+        # Scheduled from the previous due time, so uploads missed while
+        # offline are caught up back to back
+        self.next_upload += self.options['TransInterval'] * 60 / self.fleet.args.speed
+        return True
+
+    def connect_and_flush(self):
+        """Handshake (retrying after ErrorDelay) and send everything that is due"""
+        while not self.handshake():
+            if not self.wait(self.options['ErrorDelay']):
+                return
+        if self.next_upload is None:
+            self.next_upload = time.monotonic() + self.options['TransInterval'] * 60 / self.fleet.args.speed
+        if self.backlog and self.send_upload(self.backlog, 'backlog'):
+            self.backlog = None
+        while self.upload_due() and not self.fleet.stop_event.is_set():
+            if not self.send_next_upload():
+                break
+
+    def run(self):
+        if not self.wait(self.fleet.start_delay(self)):
+            return
+        self.connect_and_flush()
+
+        while not self.fleet.stop_event.is_set():
+            self.wait_out_outage()
+            if self.fleet.stop_event.is_set():
+                break
+
+            if self.upload_due():
+                if not self.send_next_upload() and not self.wait(self.options['ErrorDelay']):
+                    break
+                continue
+
+            if self.request('getrequest', 'GET', 'getrequest', {}) is None:
+                delay = self.options['ErrorDelay']
+            else:
+                delay = self.options['Delay']
+            if not self.wait(delay):
+                break
+        self.disconnect()
+
+class Fleet:
+    def __init__(self, args):
+        self.args = args
+        url = urlparse(args.url)
+        self.scheme = url.scheme or 'http'
+        self.host = url.hostname
+        self.port = url.port or (443 if self.scheme == 'https' else 80)
+        self.base_path = url.path.rstrip('/')
+        self.headers = {'User-Agent': 'iClock Proxy/1.09'}
+        if args.host_header:
+            self.headers['Host'] = args.host_header
+
+        self.stats = Stats()
+        self.stop_event = threading.Event()
+        self.outage_over = threading.Event()
+        self.started = 0.0
+
+        uploads = generate_uploads(
+            args.users, args.devices, args.days, args.duplicate_ratio, args.upload_size, args.seed
+        )
+        per_device: Dict[str, List[Upload]] = {}
+        for upload in uploads:
+            per_device.setdefault(upload.serial_number, []).append(upload)
+        self.devices = [SimulatedDevice(serial, device_uploads, self) for serial, device_uploads in per_device.items()]
+
+    def connect(self) -> http.client.HTTPConnection:
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.args.timeout)
+
+    def start_delay(self, device: SimulatedDevice) -> float:
+        """Simulated seconds before a device first connects, spread over --ramp-up"""
+        if not self.args.ramp_up:
+            return 0
+        return self.devices.index(device) * self.args.ramp_up * self.args.speed / len(self.devices)
+
+    def in_outage(self) -> bool:
+        if self.args.outage_at is None:
+            return False
+        elapsed = time.monotonic() - self.started
+        return self.args.outage_at <= elapsed < self.args.outage_at + self.args.outage_for
+
+    def run(self) -> Dict:
+        self.started = time.monotonic()
+        for device in self.devices:
+            device.start()
+
+        outage_timer = None
+        if self.args.outage_at is not None:
+            outage_timer = threading.Timer(self.args.outage_at + self.args.outage_for, self.outage_over.set)
+            outage_timer.daemon = True
+            outage_timer.start()
+
+        try:
+            self.stop_event.wait(self.args.duration)
+        except KeyboardInterrupt:
+            pass
+        self.stop_event.set()
+        self.outage_over.set()
+        for device in self.devices:
+            device.join(self.args.timeout + 1)
+        if outage_timer:
+            outage_timer.cancel()
+        return self.stats.summary(time.monotonic() - self.started)
+
+def count_duplicate_checkins(args) -> Dict:
+    """Count Employee Checkins in the workload's date range, and duplicate (employee, time) pairs"""
+    import requests
+    session = requests.Session()
+    session.headers['Authorization'] = f"token {args.api_key}:{args.api_secret}"
+    until = START_DATE + timedelta(days=args.days + 1)
+    filters = [['time', '>=', str(START_DATE)], ['time', '<', str(until)]]
+
+    rows = 0
+    seen = set()
+    start = 0
+    page_size = 5000
+    while True:
+        response = session.get(f"{args.erpnext_url.rstrip('/')}/api/resource/Employee Checkin", params={
+            'fields': json.dumps(['employee', 'time']),
+            'filters': json.dumps(filters),
+            'limit_start': start,
+            'limit_page_length': page_size
+        })
+        response.raise_for_status()
+        checkins = response.json().get('data', [])
+        rows += len(checkins)
+        seen.update((checkin['employee'], checkin['time']) for checkin in checkins)
+        if len(checkins) < page_size:
+            break
+        start += page_size
+    return {'checkins': rows, 'duplicate_checkins': rows - len(seen)}
+
+def print_summary(summary: Dict):
+    print(f"{'request':<11} {'count':>8} {'errors':>7} {'err %':>6} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, row in summary['requests'].items():
+        print(
+            f"{kind:<11} {row['requests']:>8} {row['errors']:>7} {row['error_rate'] * 100:>6.2f} {row['per_sec']:>8.1f} "
+            f"{row['p50_ms']:>8.1f} {row['p90_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}"
+        )
+    print(
+        f"\nrecords sent {summary['records_sent']} ({summary['duplicates_sent']} resent), "
+        f"acknowledged {summary['records_acknowledged']} ({summary['records_per_sec']:.0f}/s) "
+        f"in {summary['elapsed']:.1f}s"
+    )
+    if 'checkins' in summary:
+        print(f"employee checkins {summary['checkins']}, duplicate checkins {summary['duplicate_checkins']}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate ZKTeco devices pushing to an iclock endpoint")
+    parser.add_argument('url', help="server base URL, e.g. http://localhost:8000 (iclock paths are appended)")
+    parser.add_argument('--host-header', help="Host header to send, e.g. the Frappe site name")
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--users', type=int, default=2000, help="users spread over the devices")
+    parser.add_argument('--days', type=int, default=30, help="days of punches per device")
+    parser.add_argument('--upload-size', type=int, default=20, help="new records per upload")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05, help="share of uploaded lines already sent")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=60, help="wall-clock seconds to run")
+    parser.add_argument('--speed', type=float, default=1, help="simulated seconds per wall-clock second")
+    parser.add_argument('--ramp-up', type=float, default=0, help="wall-clock seconds over which devices first connect")
+    parser.add_argument('--backlog-uploads', type=int, default=0, help="uploads each device sends as one dump on startup")
+    parser.add_argument('--outage-at', type=float, help="wall-clock second at which all devices go silent")
+    parser.add_argument('--outage-for', type=float, default=10, help="outage length in wall-clock seconds")
+    parser.add_argument('--timeout', type=float, default=30, help="per-request timeout in seconds")
+    parser.add_argument('--erpnext-url', help="count duplicate Employee Checkins here after the run")
+    parser.add_argument('--api-key', default='')
+    parser.add_argument('--api-secret', default='')
+    parser.add_argument('--json', help="also write the summary to this file")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+    if args.speed <= 0:
+        print("--speed must be positive", file=sys.stderr)
+        return 2
+
+    fleet = Fleet(args)
+    print(f"Simulating {len(fleet.devices)} devices against {args.url} for {args.duration:.0f}s", flush=True)
+    summary = fleet.run()
+    if args.erpnext_url:
+        summary.update(count_duplicate_checkins(args))
+
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+In-memory ZKTeco terminals for pull-mode tests and benchmarks
+
+FakeDeviceFleet is a DeviceManager connection factory: pass it to
+ADMSServer (or DeviceManager) in place of zklib_connection and every
+configured device IP is served from memory with the zklib client
+interface. Each FakeDevice holds an attendance buffer and can be made
+slow, flaky or unresponsive:
+
+    fleet = FakeDeviceFleet.generate(users=500, devices=10, days=5, latency=0.02)
+    fleet['10.0.0.3'].hang = 10  # stops answering; the poll times out
+    config = Config(DEVICES=fleet.device_configs(), DEVICE_TIMEOUT=5)
+    server = ADMSServer(config, connection_factory=fleet)
+    server.fetch_and_store_logs()
+"""
+
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.attlog import CHECK_IN, device_ip, device_user_ids, generate_punches
+
+# zklib reports status 1 for check-in (see DeviceManager.fetch_attendance_logs)
+ZKLIB_IN = 1
+ZKLIB_OUT = 0
+
+class FakeDevice:
+    """State of one emulated terminal, shared by every connection to it"""
+
+    def __init__(self, ip: str, attendance: Optional[List[Tuple[str, datetime, int]]] = None,
+                 latency: float = 0.0, record_latency: float = 0.0, connect_failure_rate: float = 0.0,
+                 transfer_failure_rate: float = 0.0, hang: float = 0.0, seed: int = 1):
+        self.ip = ip
+        self.attendance = list(attendance or [])  # (user_id, timestamp, status) as zklib returns them
+        self.latency = latency  # seconds per command round trip
+        self.record_latency = record_latency  # extra seconds per record transferred
+        self.connect_failure_rate = connect_failure_rate
+        self.transfer_failure_rate = transfer_failure_rate
+        self.hang = hang  # seconds get_attendance stalls before answering
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.enabled = True
+        self.connections = 0
+        self.failures = 0
+
+    def add_punch(self, user_id: str, timestamp: datetime, check_in: bool = True):
+        with self.lock:
+            self.attendance.append((user_id, timestamp, ZKLIB_IN if check_in else ZKLIB_OUT))
+
+    def fails(self, rate: float) -> bool:
+        with self.lock:
+            failed = bool(rate) and self.random.random() < rate
+            if failed:
+                self.failures += 1
+            return failed
+
+class FakeDeviceConnection:
+    """zklib.ZKLib look-alike bound to a FakeDevice"""
+
+    def __init__(self, device: FakeDevice, timeout: Optional[float] = None):
+        self.device = device
+        self.timeout = timeout  # seconds to wait for each reply, as the socket timeout in zklib
+        self.connected = False
+
+    def command(self):
+        if not self.connected:
+            raise OSError(f"Not connected to {self.device.ip}")
+        if self.device.latency:
+            time.sleep(self.device.latency)
+
+    def connect(self) -> bool:
+        if self.device.latency:
+            time.sleep(self.device.latency)
+        if self.device.fails(self.device.connect_failure_rate):
+            return False
+        with self.device.lock:
+            self.device.connections += 1
+        self.connected = True
+        return True
+
+    def disable_device(self):
+        self.command()
+        self.device.enabled = False
+
+    def enable_device(self):
+        self.command()
+        self.device.enabled = True
+
+    def get_attendance(self) -> List[Tuple[str, datetime, int]]:
+        self.command()
+        if self.device.hang:
+            if self.timeout and self.device.hang > self.timeout:
+                time.sleep(self.timeout)
+                raise TimeoutError(f"timed out waiting for {self.device.ip}")
+            time.sleep(self.device.hang)
+        with self.device.lock:
+            attendance = list(self.device.attendance)
+        if self.device.record_latency:
+            time.sleep(self.device.record_latency * len(attendance))
+        if self.device.fails(self.device.transfer_failure_rate):
+            raise OSError(f"timed out reading attendance from {self.device.ip}")
+        return attendance
+
+    def clear_attendance(self):
+        self.command()
+        with self.device.lock:
+            self.device.attendance = []
+
+    def disconnect(self):
+        self.connected = False
+
+class FakeDeviceFleet:
+    """Connection factory serving FakeDevices by IP"""
+
+    def __init__(self, devices: List[FakeDevice]):
+        self.devices = {device.ip: device for device in devices}
+
+    def __getitem__(self, ip: str) -> FakeDevice:
+        return self.devices[ip]
+
+    def __call__(self, device: Dict) -> FakeDeviceConnection:
+        if device['ip'] not in self.devices:
+            raise OSError(f"No route to host {device['ip']}")
+        return FakeDeviceConnection(self.devices[device['ip']], device.get('timeout'))
+
+    def device_configs(self) -> List[Dict]:
+        """DEVICES entries for the config"""
+        return [{'ip': ip, 'port': 4370} for ip in self.devices]
+
+    @classmethod
+    def generate(cls, users: int = 500, devices: int = 10, days: int = 5, seed: int = 1,
+                 **device_options) -> 'FakeDeviceFleet':
+        """Devices with the users and daily punches of the benchmarks.attlog workload"""
+        rng = random.Random(seed)
+        fleet = []
+        for index in range(devices):
+            attendance = [
+                (str(user_id), timestamp, ZKLIB_IN if status == CHECK_IN else ZKLIB_OUT)
+                for timestamp, user_id, status, verify in generate_punches(
+                    rng, device_user_ids(index, users, devices), days
+                )
+            ]
+            fleet.append(FakeDevice(device_ip(index), attendance, seed=seed + index, **device_options))
+        return cls(fleet)
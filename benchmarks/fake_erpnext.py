@@ -0,0 +1,132 @@
+"""
+Local stand-in for the ERPNext endpoints used by adms_server.ERPNextClient
+
+Serves the Employee list, single Employee Checkin inserts and the
+zk_adms.api.bulk_employee_checkin method, with optional added latency and
+a share of requests failing with HTTP 503.
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+class FakeERPNext(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, employees: List[Dict], latency: float = 0.0, failure_rate: float = 0.0,
+                 address: tuple = ('127.0.0.1', 0), seed: int = 1):
+        super().__init__(address, FakeERPNextHandler)
+        self.employees = employees
+        self.known_employees = {employee['name'] for employee in employees}
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.checkins = set()  # (employee, time) pairs created
+        self.duplicate_checkins = 0
+        self.requests = 0
+        self.failures = 0
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeERPNext':
+        self.thread = threading.Thread(target=self.serve_forever, name='fake-erpnext', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                self.failures += 1
+                return True
+        return False
+
+    def add_checkin(self, checkin: Dict) -> Dict:
+        """Store one checkin the way bulk_employee_checkin reports it"""
+        if checkin.get('employee') not in self.known_employees:
+            return {'status': 'Failed', 'error': f"No employee for user {checkin.get('user_id')}"}
+        key = (checkin['employee'], checkin['time'])
+        with self.lock:
+            if key in self.checkins:
+                self.duplicate_checkins += 1
+                return {'status': 'Duplicate', 'name': None}
+            self.checkins.add(key)
+            name = f"EMP-CKIN-{len(self.checkins):07d}"
+        return {'status': 'Created', 'name': name}
+
+class FakeERPNextHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, delayed ACKs
+    # add ~40 ms to every keep-alive request
+    disable_nagle_algorithm = True
+
+    def send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self) -> Dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def delay(self) -> bool:
+        """Apply the configured latency; False when this request should fail"""
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.should_fail():
+            self.send_json(503, {'exc': 'Service Unavailable'})
+            return False
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/api/resource/Employee':
+            self.send_json(404, {'exc': 'Not Found'})
+            return
+        if not self.delay():
+            return
+        params = parse_qs(url.query)
+        start = int(params.get('limit_start', ['0'])[0])
+        length = int(params.get('limit_page_length', ['20'])[0])
+        self.send_json(200, {'data': self.server.employees[start:start + length]})
+
+    def do_POST(self):
+        path = unquote(urlparse(self.path).path)
+        payload = self.read_json()
+        if not self.delay():
+            return
+        if path == '/api/resource/Employee Checkin':
+            result = self.server.add_checkin(payload)
+            if result['status'] == 'Failed':
+                self.send_json(417, {'exc': result['error']})
+            elif result['status'] == 'Duplicate':
+                # HRMS rejects a repeated (employee, time) in Employee Checkin.validate
+                self.send_json(417, {'exc_type': 'ValidationError', '_server_messages': json.dumps([json.dumps(
+                    {'message': "This employee already has a log with the same timestamp."}
+                )])})
+            else:
+                self.send_json(200, {'data': {'name': result['name']}})
+        elif path == '/api/method/zk_adms.api.bulk_employee_checkin':
+            results = [self.server.add_checkin(checkin) for checkin in payload.get('checkins', [])]
+            self.send_json(200, {'message': results})
+        else:
+            self.send_json(404, {'exc': 'Not Found'})
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Ingestion and sync benchmarks
+
+Runs each scenario on the same synthetic ATTLOG workload in its own Python
+process (so peak RSS is per scenario), reports records/sec, p50/p99
+latency and peak RSS, and compares the results with a stored baseline.
+
+Scenarios:
+    parse       zk_adms.parser over each upload body (latency per upload)
+    store       DatabaseManager.add_logs_bulk per upload, duplicates included
+    push        ADMSServer.store_pushed_logs per upload (parse + store)
+    sync        ADMSServer.sync_to_erpnext, one request per log, against a
+                local fake ERPNext (latency per ERPNext request)
+    sync_batch  the same through bulk_employee_checkin (--sync-batch-size)
+    poll        ADMSServer.fetch_and_store_logs over in-memory fake devices
+                (benchmarks/fake_device.py; latency per device poll)
+
+Usage:
+    python benchmarks/run.py                    # run all, compare with baseline
+    python benchmarks/run.py --scenarios parse,store
+    python benchmarks/run.py --save-baseline    # record a new baseline
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+# Run from a checkout: make adms_server and zk_adms importable
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.attlog import generate_uploads, iter_employees
+
+SCENARIOS = ('parse', 'store', 'push', 'sync', 'sync_batch', 'poll')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Options that define the workload; results are only compared like for like
+WORKLOAD_OPTIONS = (
+    'users', 'devices', 'days', 'duplicate_ratio', 'upload_size', 'seed',
+    'sync_concurrency', 'sync_batch_size', 'erpnext_latency', 'erpnext_failure_rate',
+    'poll_concurrency', 'device_latency', 'device_failure_rate', 'hung_devices', 'device_timeout'
+)
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of unsorted values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def make_server(database_url: str, erpnext_url: str = '', connection_factory=None, **overrides):
+    from adms_server import ADMSServer, Config, zklib_connection
+    config = Config(
+        DATABASE_URL=database_url,
+        ERPNEXT_URL=erpnext_url,
+        ERPNEXT_API_KEY='benchmark' if erpnext_url else '',
+        ERPNEXT_API_SECRET='benchmark',
+        LOG_LEVEL='WARNING',
+        LOG_FILE=os.devnull,
+        **overrides
+    )
+    return ADMSServer(config, connection_factory or zklib_connection)
+
+def upload_logs(upload) -> List[Dict]:
+    from zk_adms.parser import iter_lines, parse_upload
+    return [{
+        'device_ip': upload.device_ip,
+        'user_id': record['user_id'],
+        'timestamp': record['timestamp'],
+        'status': record['punch_type']
+    } for kind, record in parse_upload('ATTLOG', iter_lines(io.StringIO(upload.body)))]
+
+def run_parse(args, uploads, database_url: str) -> Dict:
+    from zk_adms.parser import iter_lines, parse_upload
+    latencies = []
+    records = 0
+    for upload in uploads:
+        body = upload.body.encode()
+        started = time.perf_counter()
+        records += sum(1 for _ in parse_upload('ATTLOG', iter_lines(io.BytesIO(body))))
+        latencies.append(time.perf_counter() - started)
+    return {'records': records, 'latencies': latencies}
+
+def run_store(args, uploads, database_url: str) -> Dict:
+    from adms_server import DatabaseManager
+    db_manager = DatabaseManager(database_url)
+    batches = [upload_logs(upload) for upload in uploads]
+    latencies = []
+    inserted = 0
+    for logs in batches:
+        started = time.perf_counter()
+        inserted += db_manager.add_logs_bulk(logs)
+        latencies.append(time.perf_counter() - started)
+    records = sum(len(logs) for logs in batches)
+    return {'records': records, 'latencies': latencies, 'inserted': inserted, 'duplicates': records - inserted}
+
+def run_push(args, uploads, database_url: str) -> Dict:
+    from zk_adms.parser import iter_lines
+    server = make_server(database_url)
+    latencies = []
+    inserted = 0
+    for upload in uploads:
+        body = upload.body.encode()
+        started = time.perf_counter()
+        inserted += server.store_pushed_logs(upload.device_ip, 'ATTLOG', iter_lines(io.BytesIO(body)))
+        latencies.append(time.perf_counter() - started)
+    records = sum(upload.records for upload in uploads)
+    return {'records': records, 'latencies': latencies, 'inserted': inserted, 'duplicates': records - inserted}
+
+def run_sync(args, uploads, database_url: str, batch_size: int = 0) -> Dict:
+    from benchmarks.fake_erpnext import FakeERPNext
+    erpnext = FakeERPNext(
+        list(iter_employees(args.users)), args.erpnext_latency / 1000, args.erpnext_failure_rate, seed=args.seed
+    ).start()
+    try:
+        server = make_server(
+            database_url, erpnext.url,
+            SYNC_CONCURRENCY=args.sync_concurrency,
+            SYNC_BATCH_SIZE=batch_size
+        )
+        for upload in uploads:
+            server.db_manager.add_logs_bulk(upload_logs(upload))
+
+        # Time every ERPNext request made by the client
+        latencies = []
+        client = server.erpnext_client
+        send = client.request
+
+        def timed_request(*request_args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return send(*request_args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - started)
+        client.request = timed_request
+
+        records = 0
+        while True:
+            synced = server.sync_to_erpnext()
+            if not synced:
+                break
+            records += synced
+        server.sync_executor.shutdown()
+        return {
+            'records': records,
+            'latencies': latencies,
+            'requests': erpnext.requests,
+            'failed_requests': erpnext.failures,
+            'duplicate_checkins': erpnext.duplicate_checkins,
+            'unsynced': server.db_manager.count_unsynced()
+        }
+    finally:
+        erpnext.stop()
+
+def run_sync_batch(args, uploads, database_url: str) -> Dict:
+    return run_sync(args, uploads, database_url, batch_size=args.sync_batch_size)
+
+def run_poll(args, uploads, database_url: str) -> Dict:
+    from benchmarks.fake_device import FakeDeviceFleet
+    fleet = FakeDeviceFleet.generate(
+        args.users, args.devices, args.days, args.seed,
+        latency=args.device_latency / 1000, transfer_failure_rate=args.device_failure_rate
+    )
+    # Hung devices never answer within DEVICE_TIMEOUT and are abandoned
+    for device in list(fleet.devices.values())[:args.hung_devices]:
+        device.hang = args.device_timeout + 2
+
+    server = make_server(
+        database_url, connection_factory=fleet,
+        DEVICES=fleet.device_configs(),
+        POLL_CONCURRENCY=args.poll_concurrency,
+        DEVICE_TIMEOUT=args.device_timeout
+    )
+
+    # Time each device poll
+    latencies = []
+    fetched = []
+    manager = server.device_manager
+    fetch = manager.fetch_attendance_logs
+
+    def timed_fetch(*fetch_args, **kwargs):
+        started = time.perf_counter()
+        try:
+            logs = fetch(*fetch_args, **kwargs)
+            fetched.append(len(logs))
+            return logs
+        finally:
+            latencies.append(time.perf_counter() - started)
+    manager.fetch_attendance_logs = timed_fetch
+
+    inserted = server.fetch_and_store_logs()
+    return {
+        'records': sum(fetched),
+        'latencies': list(latencies),
+        'inserted': inserted,
+        'abandoned_polls': len(fleet.devices) - len(latencies),
+        'failed_polls': sum(device.failures for device in fleet.devices.values())
+    }
+
+def run_scenario(name: str, args) -> Dict:
+    """Run one scenario in this process and summarize it"""
+    uploads = generate_uploads(
+        args.users, args.devices, args.days, args.duplicate_ratio, args.upload_size, args.seed
+    )
+    runner = globals()[f"run_{name}"]
+    with tempfile.TemporaryDirectory(prefix='zk_adms_bench_') as directory:
+        database_url = args.database_url or f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        started = time.perf_counter()
+        result = runner(args, uploads, database_url)
+        seconds = time.perf_counter() - started
+
+    latencies = result.pop('latencies')
+    summary = {
+        'records': result.pop('records'),
+        'seconds': round(seconds, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+    summary['records_per_sec'] = round(summary['records'] / seconds, 1) if seconds else 0.0
+    summary.update(result)
+    return summary
+
+def run_in_subprocess(name: str, args) -> Dict:
+    command = [sys.executable, os.path.abspath(__file__), '--child', name]
+    for option in WORKLOAD_OPTIONS:
+        command.extend([f"--{option.replace('_', '-')}", str(getattr(args, option))])
+    if args.database_url:
+        command.extend(['--database-url', args.database_url])
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Scenario {name} failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Regressions beyond tolerance in throughput or peak memory"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        if result['records_per_sec'] < previous['records_per_sec'] * (1 - tolerance):
+            regressions.append(
+                f"{name}: {result['records_per_sec']:.0f} records/sec vs {previous['records_per_sec']:.0f} in baseline"
+            )
+        if result['peak_rss_mb'] > previous['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {result['peak_rss_mb']} MB vs {previous['peak_rss_mb']} MB in baseline")
+    return regressions
+
+def print_results(results: Dict, baseline: Dict):
+    print(f"{'scenario':<12} {'records':>9} {'records/s':>11} {'p50 ms':>9} {'p99 ms':>9} {'RSS MB':>8} {'vs baseline':>12}")
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        change = ''
+        if previous and previous['records_per_sec']:
+            change = f"{(result['records_per_sec'] / previous['records_per_sec'] - 1) * 100:+.1f}%"
+        print(
+            f"{name:<12} {result['records']:>9} {result['records_per_sec']:>11.0f} {result['p50_ms']:>9.3f} "
+            f"{result['p99_ms']:>9.3f} {result['peak_rss_mb']:>8.1f} {change:>12}"
+        )
+
+def load_baseline(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ADMS ingestion and ERPNext sync")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="comma-separated scenarios to run")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--days', type=int, default=5)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1, help="share of uploaded lines already sent")
+    parser.add_argument('--upload-size', type=int, default=50, help="new records per upload")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--sync-concurrency', type=int, default=4)
+    parser.add_argument('--sync-batch-size', type=int, default=100, help="chunk size for sync_batch")
+    parser.add_argument('--erpnext-latency', type=float, default=0.0, help="added ms per fake ERPNext request")
+    parser.add_argument('--erpnext-failure-rate', type=float, default=0.0, help="share of fake ERPNext requests failing with 503")
+    parser.add_argument('--poll-concurrency', type=int, default=8)
+    parser.add_argument('--device-latency', type=float, default=0.0, help="ms per fake device command")
+    parser.add_argument('--device-failure-rate', type=float, default=0.0, help="share of fake device transfers failing")
+    parser.add_argument('--hung-devices', type=int, default=0, help="fake devices that never answer within the timeout")
+    parser.add_argument('--device-timeout', type=int, default=2, help="DEVICE_TIMEOUT for poll, in seconds")
+    parser.add_argument('--database-url', help="empty database to use instead of a temporary SQLite file")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="write the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown before failing (0.2 = 20%%)")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--child', choices=SCENARIOS, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+    if args.child:
+        print(json.dumps(run_scenario(args.child, args)))
+        return 0
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    results = {name: run_in_subprocess(name, args) for name in names}
+    workload = {option: getattr(args, option) for option in WORKLOAD_OPTIONS}
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'workload': workload,
+        'results': results
+    }
+
+    baseline = load_baseline(args.baseline)
+    comparable = baseline.get('workload') == workload
+    print_results(results, baseline if comparable else {})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not baseline:
+        print("No baseline yet; run with --save-baseline to record one")
+        return 0
+    if not comparable:
+        print("Baseline was recorded with a different workload; not compared")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,12 +7,113 @@ Tests device connectivity, database operations, and ERPNext integration
 import sys
 import os
 import json
+import socket
+import tempfile
+import http.client
+import http.server
+import time
+import urllib.parse
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
 
 # Add current directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from adms_server import DatabaseManager, ERPNextClient, DeviceManager, load_config
+from adms_server import ADMSServer, Config, DatabaseManager, ERPNextClient, DeviceManager, load_config, create_flask_app, EMPLOYEE_MISS_REFRESH
+from benchmarks.fake_device import FakeDevice, FakeDeviceFleet
+import zk_proxy_server
+
+class FakeUpstream(http.server.ThreadingHTTPServer):
+    """Frappe site stand-in for the proxy tests
+    
+    Every request is answered with `status` and `reply`; uploads answered
+    200 OK are recorded in `uploads` as (SN, body).
+    """
+    daemon_threads = True
+    
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeUpstreamHandler)
+        self.status = 200
+        self.reply = b'OK'
+        self.uploads = []
+        Thread(target=self.serve_forever, daemon=True).start()
+    
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class FakeUpstreamHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET(self):
+        self.answer(b'')
+    
+    def do_POST(self):
+        self.answer(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+    
+    def answer(self, body):
+        status, reply = self.server.status, self.server.reply
+        if self.command == 'POST' and status == 200 and reply == b'OK':
+            self.server.uploads.append((zk_proxy_server.device_serial(self.path), body))
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+    
+    def log_message(self, format, *args):
+        pass
+
+class FakeERPNext(http.server.ThreadingHTTPServer):
+    """ERPNext stand-in for the sync tests
+    
+    Serves the Employee list from `employees` (device_user_id -> name),
+    counting full loads in `employee_loads`, and records created checkins.
+    """
+    daemon_threads = True
+    
+    def __init__(self, employees):
+        super().__init__(('127.0.0.1', 0), FakeERPNextHandler)
+        self.employees = dict(employees)
+        self.employee_loads = 0
+        self.checkins = []
+        self.url = f'http://{self.server_address[0]}:{self.server_address[1]}'
+        Thread(target=self.serve_forever, daemon=True).start()
+    
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class FakeERPNextHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        start = int(query['limit_start'][0])
+        length = int(query['limit_page_length'][0])
+        if start == 0:
+            self.server.employee_loads += 1
+        employees = sorted(
+            ({'name': name, 'device_user_id': user_id} for user_id, name in self.server.employees.items()),
+            key=lambda employee: employee['name']
+        )
+        self.answer({'data': employees[start:start + length]})
+    
+    def do_POST(self):
+        checkin = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.checkins.append(checkin)
+        self.answer({'data': checkin})
+    
+    def answer(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
 
 def test_database():
     """Test database operations"""
@@ -43,6 +144,61 @@ def test_database():
     
     return True
 
+def test_concurrent_writes():
+    """Test that overlapping bulk inserts from several threads store each log once"""
+    print("Testing concurrent database writes...")
+    
+    def insert(worker):
+        # Each worker's second half is the next worker's first half
+        return db.add_logs_bulk([
+            {'device_ip': '192.168.1.201', 'user_id': str(user_id), 'timestamp': datetime(2024, 1, 1, 9, 0), 'status': 'IN'}
+            for user_id in range(worker * 100, worker * 100 + 200)
+        ])
+    
+    with tempfile.TemporaryDirectory() as directory:
+        db = DatabaseManager(f"sqlite:///{os.path.join(directory, 'test.db')}")
+        try:
+            with ThreadPoolExecutor(8) as executor:
+                inserted = sum(executor.map(insert, range(8)))
+            stored = db.count_unsynced()
+        except Exception as e:
+            print(f"✗ Concurrent writes failed: {e}")
+            return False
+        finally:
+            db.engine.dispose()
+    
+    if inserted == stored == 900:
+        print("✓ 1600 overlapping rows stored as 900 logs")
+        return True
+    print(f"✗ inserted={inserted} stored={stored}")
+    return False
+
+def test_push_receiver():
+    """Test that pushed logs are keyed by device and acknowledged through the handshake Stamp"""
+    print("Testing ADMS push receiver...")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        server = ADMSServer(Config(
+            DATABASE_URL=f"sqlite:///{os.path.join(directory, 'test.db')}",
+            DEVICES=[{'ip': '10.0.0.5', 'port': 4370, 'serial_number': 'PUSH1'}],
+            LOG_FILE=os.devnull
+        ))
+        try:
+            client = create_flask_app(server).test_client()
+            first_handshake = client.get('/iclock/cdata?SN=PUSH1&options=all').get_data(as_text=True)
+            for sn in ('PUSH1', 'PUSH2'):
+                client.post(f'/iclock/cdata?SN={sn}&table=ATTLOG&Stamp=100', data='1\t2024-01-01 09:00:00\t0\t1\n')
+            handshake = client.get('/iclock/cdata?SN=PUSH1&options=all').get_data(as_text=True)
+            devices = sorted(log['device_ip'] for log in server.db_manager.get_all_logs())
+        finally:
+            server.sync_executor.shutdown()
+    
+    if 'ATTLOGStamp=None' in first_handshake and 'ATTLOGStamp=100' in handshake and devices == ['10.0.0.5', 'PUSH2']:
+        print("✓ Logs keyed by configured IP or serial number, Stamp acknowledged")
+        return True
+    print(f"✗ devices={devices} handshake={handshake.splitlines()[:3]}")
+    return False
+
 def test_device_connection(config):
     """Test device connectivity"""
     print("Testing device connections...")
@@ -91,6 +247,296 @@ def test_erpnext_connection(config):
     
     return True
 
+def test_sync_with_erpnext_down():
+    """Test that an unreachable ERPNext leaves logs queued instead of dead-lettering them"""
+    print("Testing sync with ERPNext down...")
+    
+    # A port nothing listens on
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    
+    with tempfile.TemporaryDirectory() as directory:
+        server = ADMSServer(Config(
+            DATABASE_URL=f"sqlite:///{os.path.join(directory, 'test.db')}",
+            ERPNEXT_URL=f"http://127.0.0.1:{port}",
+            ERPNEXT_API_KEY="key",
+            ERPNEXT_API_SECRET="secret",
+            LOG_FILE=os.devnull
+        ))
+        try:
+            server.db_manager.add_logs_bulk([
+                {'device_ip': '192.168.1.201', 'user_id': str(i), 'timestamp': datetime(2024, 1, 1, 9, i), 'status': 'IN'}
+                for i in range(5)
+            ])
+            synced = server.sync_to_erpnext()
+            dead = server.db_manager.count_dead_letters()
+            unsynced = server.db_manager.count_unsynced()
+        finally:
+            server.sync_executor.shutdown()
+    
+    if synced == 0 and dead == 0 and unsynced == 5 and server.sync_stalled:
+        print("✓ Logs kept for retry and sync worker backs off")
+        return True
+    print(f"✗ synced={synced} dead_letters={dead} unsynced={unsynced} stalled={server.sync_stalled}")
+    return False
+
+def test_dead_letters_and_retry():
+    """Test that logs with no employee are dead-lettered and synced after /api/sync/retry"""
+    print("Testing dead letters and /api/sync/retry...")
+    
+    erpnext = FakeERPNext({'1': 'EMP-0001'})
+    with tempfile.TemporaryDirectory() as directory:
+        server = ADMSServer(Config(
+            DATABASE_URL=f"sqlite:///{os.path.join(directory, 'test.db')}",
+            ERPNEXT_URL=erpnext.url,
+            ERPNEXT_API_KEY="key",
+            ERPNEXT_API_SECRET="secret",
+            LOG_FILE=os.devnull
+        ))
+        try:
+            server.db_manager.add_logs_bulk([
+                {'device_ip': '192.168.1.201', 'user_id': user_id, 'timestamp': datetime(2024, 1, 1, 9, 0), 'status': 'IN'}
+                for user_id in ('1', '2')
+            ])
+            first_sync = server.sync_to_erpnext()
+            dead = server.db_manager.count_dead_letters()
+            # Not retried by the sync worker until requeued
+            idle_sync = server.sync_to_erpnext()
+            
+            # The missing employee is mapped in ERPNext, then the dead letters retried
+            erpnext.employees['2'] = 'EMP-0002'
+            retry = create_flask_app(server).test_client().post('/api/sync/retry').get_json()
+            retry_sync = server.sync_to_erpnext()
+            remaining = server.db_manager.count_unsynced() + server.db_manager.count_dead_letters()
+        finally:
+            server.sync_executor.shutdown()
+            erpnext.stop()
+    
+    employees = sorted(checkin['employee'] for checkin in erpnext.checkins)
+    if (first_sync == 1 and dead == 1 and idle_sync == 0 and retry['requeued'] == 1
+            and retry_sync == 1 and remaining == 0 and employees == ['EMP-0001', 'EMP-0002']):
+        print("✓ Dead letter held back, then synced after retry")
+        return True
+    print(f"✗ first_sync={first_sync} dead_letters={dead} idle_sync={idle_sync} retry={retry} "
+          f"retry_sync={retry_sync} remaining={remaining} checkins={employees}")
+    return False
+
+def test_employee_map_refresh():
+    """Test that the employee map is cached for its TTL and reloaded for an unknown user_id"""
+    print("Testing employee map cache...")
+    
+    erpnext = FakeERPNext({'1': 'EMP-0001'})
+    client = ERPNextClient(erpnext.url, "key", "secret", employee_cache_ttl=300)
+    try:
+        cached = [client.get_employee('1') for _ in range(3)]
+        loads_cached = erpnext.employee_loads
+        
+        # Added in ERPNext after the map was loaded; a recent load is not repeated
+        erpnext.employees['2'] = 'EMP-0002'
+        early_miss = client.get_employee('2')
+        loads_early_miss = erpnext.employee_loads
+        
+        client.employee_map_loaded_at -= EMPLOYEE_MISS_REFRESH
+        refreshed = client.get_employee('2')
+        loads_miss = erpnext.employee_loads
+        
+        client.employee_map_loaded_at -= client.employee_cache_ttl
+        client.load_employee_map()
+        loads_expired = erpnext.employee_loads
+    finally:
+        erpnext.stop()
+    
+    loads = (loads_cached, loads_early_miss, loads_miss, loads_expired)
+    if cached == ['EMP-0001'] * 3 and early_miss is None and refreshed == 'EMP-0002' and loads == (1, 1, 2, 3):
+        print("✓ Map cached, reloaded on a miss and after the TTL")
+        return True
+    print(f"✗ cached={cached} early_miss={early_miss} refreshed={refreshed} loads={loads}")
+    return False
+
+def test_clear_buffer_after_clock_change():
+    """Test that clearing the device buffer never drops punches stamped before the watermark"""
+    print("Testing buffer clear after a device clock change...")
+    
+    device = FakeDevice('10.0.0.1')
+    device.add_punch('1', datetime(2024, 1, 2, 9, 0))
+    with tempfile.TemporaryDirectory() as directory:
+        server = ADMSServer(Config(
+            DATABASE_URL=f"sqlite:///{os.path.join(directory, 'test.db')}",
+            DEVICES=[{'ip': '10.0.0.1', 'port': 4370}],
+            CLEAR_DEVICE_BUFFER=True,
+            LOG_FILE=os.devnull
+        ), connection_factory=FakeDeviceFleet([device]))
+        try:
+            server.fetch_and_store_logs()
+            # The clock is set back a day before the next punch
+            device.add_punch('2', datetime(2024, 1, 1, 9, 0))
+            server.fetch_and_store_logs()
+            stored = server.db_manager.count_unsynced()
+        finally:
+            server.sync_executor.shutdown()
+    
+    if stored == 2 and not device.attendance:
+        print("✓ Back-dated punch stored before the buffer was cleared")
+        return True
+    print(f"✗ stored={stored} left_on_device={len(device.attendance)}")
+    return False
+
+def test_logs_pagination_with_concurrent_inserts():
+    """Test that /api/logs pages neither skip nor repeat logs while new ones arrive"""
+    print("Testing /api/logs pagination with concurrent inserts...")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        server = ADMSServer(Config(
+            DATABASE_URL=f"sqlite:///{os.path.join(directory, 'test.db')}",
+            LOG_FILE=os.devnull
+        ))
+        try:
+            server.db_manager.add_logs_bulk([
+                {'device_ip': '192.168.1.201', 'user_id': str(i), 'timestamp': datetime(2024, 1, 1, 9, i), 'status': 'IN'}
+                for i in range(10)
+            ])
+            client = create_flask_app(server).test_client()
+            seen = []
+            late = 0
+            after_id = 0
+            while after_id is not None:
+                page = client.get(f'/api/logs?after_id={after_id}&limit=4').get_json()
+                seen.extend(log['user_id'] for log in page['logs'])
+                after_id = page['next_after_id']
+                if late < 2:
+                    # A punch stamped before everything already paged through
+                    server.db_manager.add_log('192.168.1.202', f'late{late}', datetime(2023, 12, 31, 9, late), 'IN')
+                    late += 1
+        finally:
+            server.sync_executor.shutdown()
+    
+    originals = [str(i) for i in range(10)]
+    if len(seen) == len(set(seen)) and [user for user in seen if user in originals] == originals and len(seen) == 12:
+        print("✓ Every log returned exactly once, late arrivals on later pages")
+        return True
+    print(f"✗ pages returned {seen}")
+    return False
+
+def scrape_metrics(client):
+    """Samples served at /metrics, by series name with labels"""
+    samples = {}
+    for line in client.get('/metrics').get_data(as_text=True).splitlines():
+        if line and not line.startswith('#'):
+            series, value = line.rsplit(' ', 1)
+            samples[series] = float(value)
+    return samples
+
+def test_metrics_after_ingest():
+    """Test that /metrics counts pushed records, duplicates and the sync backlog"""
+    print("Testing /metrics after an ADMS push...")
+    
+    records = ['1\t2024-01-01 09:00:00\t0\t1', '2\t2024-01-01 09:01:00\t0\t1']
+    with tempfile.TemporaryDirectory() as directory:
+        server = ADMSServer(Config(
+            DATABASE_URL=f"sqlite:///{os.path.join(directory, 'test.db')}",
+            LOG_FILE=os.devnull
+        ))
+        try:
+            client = create_flask_app(server).test_client()
+            before = scrape_metrics(client)
+            client.post('/iclock/cdata?SN=METRICS1&table=ATTLOG', data='\n'.join(records) + '\n')
+            # The device resends both with one new record
+            records.append('3\t2024-01-01 09:02:00\t0\t1')
+            client.post('/iclock/cdata?SN=METRICS1&table=ATTLOG', data='\n'.join(records) + '\n')
+            after = scrape_metrics(client)
+        finally:
+            server.sync_executor.shutdown()
+    
+    def moved(series):
+        return after.get(series, 0) - before.get(series, 0)
+    
+    device = '{device="METRICS1"}'
+    counts = {
+        'parsed': moved(f'zk_adms_records_parsed_total{device}'),
+        'inserted': moved(f'zk_adms_records_inserted_total{device}'),
+        'duplicate': moved(f'zk_adms_records_duplicate_total{device}'),
+        'requests': moved('zk_adms_iclock_request_seconds_count{endpoint="cdata",table="ATTLOG"}'),
+        'backlog': after.get('zk_adms_sync_backlog'),
+    }
+    if counts == {'parsed': 5, 'inserted': 3, 'duplicate': 2, 'requests': 2, 'backlog': 3}:
+        print("✓ Ingest counters, request latency and backlog updated")
+        return True
+    print(f"✗ metrics moved by {counts}")
+    return False
+
+def test_spool_replay_keeps_failed_ingest():
+    """Test that a replayed upload answered 200 ERROR stays in the proxy spool"""
+    print("Testing proxy replay of an upload the site failed to store...")
+    
+    upstream = FakeUpstream()
+    zk_proxy_server.pool = zk_proxy_server.ConnectionPool(*upstream.server_address)
+    with tempfile.TemporaryDirectory() as directory:
+        spool = zk_proxy_server.Spool(directory)
+        spool.append(
+            {'method': 'POST', 'path': '/iclock/cdata?SN=SPOOL1&table=ATTLOG', 'headers': {}},
+            b'1\t2024-01-01 09:00:00\t0\t1\n'
+        )
+        replayer = zk_proxy_server.SpoolReplayer(spool)
+        try:
+            # Frappe answers ERROR with HTTP 200 when ingest fails
+            upstream.reply = b'ERROR'
+            delivered = replayer.replay(spool.read_batch(10))
+            still_spooled = len(spool.read_batch(10))
+            upstream.reply = b'OK'
+            retried = replayer.replay(spool.read_batch(10))
+        finally:
+            replayer.executor.shutdown()
+            upstream.stop()
+    
+    if not delivered and still_spooled == 1 and retried and len(upstream.uploads) == 1:
+        print("✓ Upload kept and delivered on retry")
+        return True
+    print(f"✗ delivered={delivered} still_spooled={still_spooled} retried={retried} uploads={len(upstream.uploads)}")
+    return False
+
+def test_spool_survives_outage():
+    """Test that uploads spooled while the site is down survive a proxy restart and replay in order"""
+    print("Testing proxy spool through an upstream outage...")
+    
+    upstream = FakeUpstream()
+    upstream.status, upstream.reply = 503, b'Service Unavailable'
+    zk_proxy_server.pool = zk_proxy_server.ConnectionPool(*upstream.server_address)
+    uploads = [('A', b'1'), ('B', b'1'), ('A', b'2'), ('B', b'2'), ('A', b'3')]
+    with tempfile.TemporaryDirectory() as directory:
+        zk_proxy_server.spool = zk_proxy_server.Spool(directory)
+        proxy = zk_proxy_server.ZKProxyServer(('127.0.0.1', 0), zk_proxy_server.ZKProxyHandler)
+        Thread(target=proxy.serve_forever, daemon=True).start()
+        try:
+            acknowledged = 0
+            for sn, body in uploads:
+                conn = http.client.HTTPConnection(*proxy.server_address, timeout=10)
+                conn.request('POST', f'/iclock/cdata?SN={sn}&table=ATTLOG', body=body)
+                acknowledged += conn.getresponse().read() == b'OK'
+                conn.close()
+            proxy.shutdown()
+            proxy.server_close()
+            
+            # A restarted proxy picks the spool up from disk
+            zk_proxy_server.spool = zk_proxy_server.Spool(directory)
+            upstream.status, upstream.reply = 200, b'OK'
+            zk_proxy_server.SpoolReplayer(zk_proxy_server.spool).start()
+            deadline = time.monotonic() + 10
+            while zk_proxy_server.spool.pending and time.monotonic() < deadline:
+                time.sleep(0.1)
+            drained = not zk_proxy_server.spool.pending
+        finally:
+            zk_proxy_server.spool = None
+            zk_proxy_server.backend_down.clear()
+            upstream.stop()
+    
+    replayed = {sn: [body for device, body in upstream.uploads if device == sn] for sn in ('A', 'B')}
+    if acknowledged == len(uploads) and drained and replayed == {'A': [b'1', b'2', b'3'], 'B': [b'1', b'2']}:
+        print("✓ Spooled uploads replayed in order per device")
+        return True
+    print(f"✗ acknowledged={acknowledged} drained={drained} replayed={replayed}")
+    return False
+
 def test_configuration():
     """Test configuration loading"""
     print("Testing configuration...")
@@ -126,6 +572,23 @@ def main():
     
     print()
     
+    # Behaviour tests; these need no devices or ERPNext
+    for test in (
+        test_concurrent_writes,
+        test_sync_with_erpnext_down,
+        test_dead_letters_and_retry,
+        test_employee_map_refresh,
+        test_clear_buffer_after_clock_change,
+        test_logs_pagination_with_concurrent_inserts,
+        test_metrics_after_ingest,
+        test_push_receiver,
+        test_spool_replay_keeps_failed_ingest,
+        test_spool_survives_outage,
+    ):
+        if not test():
+            sys.exit(1)
+        print()
+    
     # Test device connections
     test_device_connection(config)
     
@@ -1,48 +1,117 @@
 import frappe  # type: ignore
 from frappe import _  # type: ignore
+from frappe.model.naming import parse_naming_series  # type: ignore
+from frappe.utils import add_to_date, cint, get_datetime, now_datetime  # type: ignore
 from datetime import datetime
+import io
 import json
+import time
+
+from zk_adms.commands import get_command_response, get_handshake_response, record_command_results
+from zk_adms.debug_capture import is_capture_enabled, log_request
+from zk_adms.employee_cache import get_employee_map
+from zk_adms.heartbeat import record_heartbeat
+from zk_adms.parser import iter_lines, parse_upload
+from zk_adms.site_metrics import (
+	db_commit_seconds,
+	db_write_seconds,
+	iclock_request_seconds,
+	records_duplicate,
+	records_inserted,
+	records_parsed,
+	upload_batches_processed,
+)
+
+# Uploads with at least this many records use multi-row inserts
+BULK_INGEST_THRESHOLD = 200
+
+# Queued uploads fetched per query by the background ingest job
+UPLOAD_BATCHES_PER_QUERY = 20
+
+# Attempts per upload batch before it is marked Failed, and the retry
+# delay after the first failure (doubled per attempt, up to the maximum)
+UPLOAD_MAX_ATTEMPTS = 5
+UPLOAD_RETRY_DELAY = 60
+UPLOAD_MAX_RETRY_DELAY = 3600
+
+# Upload tables whose records are parsed and stored; others (e.g. ATTPHOTO)
+# are acknowledged so the device moves on
+UPLOAD_TABLES = ("ATTLOG", "OPERLOG", "USERINFO")
+
+# Attendance Device field holding the last acknowledged Stamp per upload table
+STAMP_FIELDS = {
+	"ATTLOG": "attlog_stamp",
+	"OPERLOG": "operlog_stamp",
+}
+
+# Employee Checkin fields its controller fills from the employee's shift
+CHECKIN_SHIFT_FIELDS = ("shift", "shift_start", "shift_end", "shift_actual_start", "shift_actual_end")
+
+class BulkIngestError(Exception):
+	"""Raised when a bulk upload was rolled back and must be resent"""
 
 @frappe.whitelist(allow_guest=True, methods=["POST", "GET"])
 def iclock():
 	"""Main ADMS endpoint for ZKTeco devices"""
+	started = time.monotonic()
+	# Get device serial number from SN parameter
+	sn = frappe.form_dict.get('SN')
+	response = "ERROR"
 	try:
-		# Log the request for debugging
-		frappe.logger().info(f"ADMS Request: {frappe.request.method} {frappe.request.url}")
-		frappe.logger().info(f"Headers: {dict(frappe.request.headers)}")
-		frappe.logger().info(f"Data: {frappe.request.get_data()}")
-		
-		# Get device serial number from SN parameter
-		sn = frappe.form_dict.get('SN')
-		if not sn:
-			return "ERROR: No SN provided"
-		
-		# Handle different request types
-		if frappe.request.method == "POST":
-			return handle_post_request(sn)
-		else:
-			return handle_get_request(sn)
-			
+		response = dispatch_request(sn) if sn else "ERROR: No SN provided"
 	except Exception as e:
 		frappe.logger().error(f"ADMS Error: {str(e)}")
-		return "ERROR"
+	finally:
+		elapsed = time.monotonic() - started
+		iclock_request_seconds.observe(
+			elapsed,
+			endpoint=frappe.request.path.rstrip("/").rsplit("/", 1)[-1],
+			table=frappe.form_dict.get("table") or "",
+		)
+		# One access line per request; full headers and body only for
+		# devices with Debug Capture enabled (or a sampled share of requests)
+		log_request(sn, response, elapsed)
+	return response
+
+def dispatch_request(sn):
+	"""Handle different request types"""
+	path = frappe.request.path.rstrip("/")
+	if path.endswith("/getrequest"):
+		return handle_command_request(sn)
+	elif path.endswith("/devicecmd"):
+		return handle_command_result(sn)
+	elif frappe.request.method == "POST":
+		return handle_post_request(sn)
+	elif frappe.form_dict.get("options"):
+		return handle_handshake(sn)
+	else:
+		return handle_get_request(sn)
 
 def handle_post_request(sn):
 	"""Handle POST requests (attendance data)"""
 	try:
-		# Ensure device exists
-		device = get_or_create_device(sn)
+		# Buffer device status and sync time; flushed by the scheduler
+		record_heartbeat(sn)
 		
-		# Update device status and sync time
-		device.status = "Online"
-		device.last_sync_time = datetime.now()
-		device.ip_address = frappe.local.request_ip
-		device.save(ignore_permissions=True)
-		
-		# Process attendance data if present
-		data = frappe.request.get_data(as_text=True)
-		if data and data.strip():
-			process_attendance_data(sn, data)
+		table = (frappe.form_dict.get("table") or "ATTLOG").upper()
+		if table not in UPLOAD_TABLES:
+			frappe.logger().debug(f"Skipping {table} upload from {sn}")
+			return "OK"
+
+		if cint(frappe.conf.get("zk_adms_async_ingest")):
+			data = frappe.request.get_data(as_text=True)
+			if data and data.strip():
+				count = queue_upload(sn, data)
+				update_device_stamp(sn)
+				return f"OK: {count}"
+			return "OK"
+
+		# Frappe has already buffered the body to build form_dict, so read
+		# the cached bytes line by line instead of decoding and splitting it.
+		# Errors propagate so the stamp is not advanced and the device
+		# resends; already stored punches are skipped on the retry
+		if ingest_upload(sn, table, iter_lines(io.BytesIO(frappe.request.get_data()))):
+			update_device_stamp(sn)
 		
 		return "OK"
 		
@@ -53,14 +122,8 @@ def handle_post_request(sn):
 def handle_get_request(sn):
 	"""Handle GET requests (heartbeat/status)"""
 	try:
-		# Ensure device exists
-		device = get_or_create_device(sn)
-		
-		# Update device status and sync time
-		device.status = "Online"
-		device.last_sync_time = datetime.now()
-		device.ip_address = frappe.local.request_ip
-		device.save(ignore_permissions=True)
+		# Buffer device status and sync time; flushed by the scheduler
+		record_heartbeat(sn)
 		
 		return "OK"
 		
@@ -68,6 +131,39 @@ def handle_get_request(sn):
 		frappe.logger().error(f"GET Error: {str(e)}")
 		return "ERROR"
 
+def handle_handshake(sn):
+	"""Handle the initial GET cdata?options=all handshake"""
+	try:
+		record_heartbeat(sn)
+		return get_handshake_response(sn)
+
+	except Exception as e:
+		frappe.logger().error(f"Handshake Error: {str(e)}")
+		return "ERROR"
+
+def handle_command_request(sn):
+	"""Handle GET getrequest polls: hand out queued commands"""
+	try:
+		record_heartbeat(sn)
+		return get_command_response(sn)
+
+	except Exception as e:
+		frappe.logger().error(f"getrequest Error: {str(e)}")
+		return "ERROR"
+
+def handle_command_result(sn):
+	"""Handle POST devicecmd: record command results reported by the device"""
+	try:
+		record_heartbeat(sn)
+		data = frappe.request.get_data(as_text=True)
+		if data and data.strip():
+			record_command_results(sn, data)
+		return "OK"
+
+	except Exception as e:
+		frappe.logger().error(f"devicecmd Error: {str(e)}")
+		return "ERROR"
+
 def get_or_create_device(sn):
 	"""Get existing device or create new one"""
 	if frappe.db.exists("Attendance Device", sn):
@@ -85,66 +181,483 @@ def get_or_create_device(sn):
 def process_attendance_data(sn, data):
 	"""Process attendance data from device"""
 	try:
-		lines = data.strip().split('\n')
-		for line in lines:
-			if not line.strip():
-				continue
-				
-			# Parse attendance record
-			# Format: USER_ID\tTIMESTAMP\tPUNCH_TYPE\tOTHER_DATA
-			parts = line.split('\t')
-			if len(parts) < 3:
-				continue
-				
-			user_id = parts[0]
-			timestamp_str = parts[1]
-			punch_type = "IN" if parts[2] == "0" else "OUT"
-			
-			# Parse timestamp
-			try:
-				timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
-			except:
-				continue
-			
-			# Create ZK Log entry
-			zk_log = frappe.new_doc("ZK Log")
-			zk_log.device_serial = sn
-			zk_log.user_id = user_id
-			zk_log.timestamp = timestamp
-			zk_log.punch_type = punch_type
-			zk_log.raw_data = line
-			zk_log.insert(ignore_permissions=True)
-			
-			# Find employee by device user ID
-			employee = find_employee_by_device_id(user_id)
-			if employee:
-				# Create Employee Checkin
-				checkin = frappe.new_doc("Employee Checkin")
-				checkin.employee = employee
-				checkin.time = timestamp
-				checkin.log_type = punch_type
-				checkin.device_id = sn
-				checkin.insert(ignore_permissions=True)
-				
-				# Update ZK Log with checkin reference
-				zk_log.employee_checkin = checkin.name
-				zk_log.processed = 1
-				zk_log.save(ignore_permissions=True)
-			
+		ingest_attendance_data(sn, data)
+	except BulkIngestError:
+		raise
 	except Exception as e:
 		frappe.logger().error(f"Data processing error: {str(e)}")
 
+def ingest_attendance_data(sn, data):
+	"""Parse and store an ATTLOG body, raising on errors; returns the record count"""
+	return ingest_upload(sn, "ATTLOG", iter_lines(io.StringIO(data)))
+
+def ingest_upload(sn, table, lines):
+	"""Parse the lines of an upload and hand each record type to its sink.
+
+	Raises on errors; returns the number of records parsed.
+	"""
+	records = {}
+	for kind, record in parse_upload(table, lines):
+		records.setdefault(kind, []).append(record)
+
+	if records.get("attendance"):
+		ingest_attendance_records(sn, records["attendance"])
+	if records.get("user"):
+		sync_device_users(sn, records["user"])
+	# Operation log entries (admin actions, enrolments) are not stored; the
+	# upload is still acknowledged so the device advances its OPERLOG Stamp
+	if records.get("operation"):
+		frappe.logger().debug(f"{sn}: dropped {len(records['operation'])} operation log entries")
+	if records.get("fingerprint"):
+		frappe.logger().debug(f"{sn}: skipped {len(records['fingerprint'])} biometric templates")
+
+	return sum(len(values) for values in records.values())
+
+def ingest_attendance_records(sn, records):
+	"""Store parsed ATTLOG records, skipping punches already stored"""
+
+	# Re-uploaded punches are dropped here, before any Employee Checkin is made
+	new_records = filter_new_records(sn, records)
+	records_parsed.inc(len(records), device=sn)
+	records_duplicate.inc(len(records) - len(new_records), device=sn)
+	if not new_records:
+		return len(records)
+
+	# The raw line is only kept for devices being debugged
+	if not is_capture_enabled(sn):
+		for record in new_records:
+			record["raw_data"] = None
+
+	# Large uploads (e.g. a device flushing a weekend backlog) go through the
+	# bulk path so the request finishes before the device times out
+	threshold = cint(frappe.conf.get("zk_adms_bulk_ingest_threshold") or BULK_INGEST_THRESHOLD)
+	if len(new_records) >= threshold:
+		with db_write_seconds.time(path="bulk"):
+			bulk_insert_attendance(sn, new_records)
+	else:
+		with db_write_seconds.time(path="single"):
+			for record in new_records:
+				insert_attendance(sn, record)
+
+	records_inserted.inc(len(new_records), device=sn)
+	return len(records)
+
+def sync_device_users(sn, users):
+	"""Create or update Attendance Device User rows from USER records"""
+	employees = get_employee_map()
+
+	for user in users:
+		values = {
+			"user_name": user["user_name"],
+			"privilege": user["privilege"],
+			"card_number": user["card_number"],
+			"employee": employees.get(str(user["user_id"])),
+		}
+		name = frappe.db.get_value("Attendance Device User", {"device": sn, "user_id": user["user_id"]})
+		if name:
+			frappe.db.set_value("Attendance Device User", name, values)
+		else:
+			doc = frappe.new_doc("Attendance Device User")
+			doc.update(values)
+			doc.device = sn
+			doc.user_id = user["user_id"]
+			doc.insert(ignore_permissions=True)
+
+def filter_new_records(sn, records):
+	"""Drop records already stored for this device, and repeats within the upload"""
+	existing = set(frappe.get_all(
+		"ZK Log",
+		filters={
+			"device_serial": sn,
+			"user_id": ["in", list({record["user_id"] for record in records})],
+			"timestamp": ["between", [
+				min(record["timestamp"] for record in records),
+				max(record["timestamp"] for record in records),
+			]],
+		},
+		fields=["user_id", "timestamp"],
+		as_list=True,
+	))
+
+	new_records = []
+	for record in records:
+		key = (record["user_id"], record["timestamp"])
+		if key not in existing:
+			existing.add(key)
+			new_records.append(record)
+
+	return new_records
+
+def update_device_stamp(sn):
+	"""Persist the upload Stamp once the data is stored, so the handshake can return it"""
+	stamp = frappe.form_dict.get("Stamp")
+	fieldname = STAMP_FIELDS.get(frappe.form_dict.get("table") or "ATTLOG")
+	if not stamp or not fieldname:
+		return
+
+	if frappe.db.get_value("Attendance Device", sn, fieldname) != stamp:
+		frappe.db.set_value("Attendance Device", sn, fieldname, stamp, update_modified=False)
+
+def queue_upload(sn, data):
+	"""Store an upload as a ZK Upload Batch and queue it for background processing.
+
+	Returns the number of lines accepted, which is acknowledged to the
+	device straight away.
+	"""
+	record_count = sum(1 for line in data.splitlines() if line.strip())
+
+	batch = frappe.new_doc("ZK Upload Batch")
+	batch.device_serial = sn
+	batch.upload_table = frappe.form_dict.get("table") or "ATTLOG"
+	batch.status = "Queued"
+	batch.record_count = record_count
+	batch.data = data
+	batch.insert(ignore_permissions=True)
+
+	enqueue_device_batches(sn)
+	return record_count
+
+def enqueue_device_batches(sn):
+	"""Queue the per-device ingest job unless one is already queued or running.
+
+	One job per device keeps that device's uploads in order while different
+	devices are processed in parallel by separate workers.
+	"""
+	frappe.enqueue(
+		"zk_adms.api.process_device_batches",
+		queue="default",
+		job_id=f"zk_adms_ingest::{sn}",
+		deduplicate=True,
+		enqueue_after_commit=True,
+		sn=sn,
+	)
+
+def due_upload_filters():
+	"""or_filters matching Queued batches that are not waiting out a retry delay"""
+	return [["next_attempt_at", "is", "not set"], ["next_attempt_at", "<=", now_datetime()]]
+
+def process_device_batches(sn):
+	"""Background job: process a device's queued uploads, oldest first"""
+	while True:
+		batches = frappe.get_all(
+			"ZK Upload Batch",
+			filters={"device_serial": sn, "status": "Queued"},
+			or_filters=due_upload_filters(),
+			order_by="name asc",
+			limit=UPLOAD_BATCHES_PER_QUERY,
+			pluck="name",
+		)
+		if not batches:
+			break
+
+		for name in batches:
+			process_upload_batch(name)
+
+def process_upload_batch(name):
+	"""Ingest one ZK Upload Batch and record the outcome"""
+	batch = frappe.get_doc("ZK Upload Batch", name)
+
+	try:
+		ingest_upload(batch.device_serial, batch.upload_table or "ATTLOG", iter_lines(io.StringIO(batch.data)))
+		frappe.db.set_value(
+			"ZK Upload Batch", name, {"status": "Processed", "processed_at": now_datetime(), "error": None}
+		)
+		with db_commit_seconds.time():
+			frappe.db.commit()
+		upload_batches_processed.inc(status="Processed")
+	except Exception as e:
+		frappe.db.rollback()
+		# The device was already told OK, so the batch is the only copy of
+		# the upload: keep it Queued and retry later (lock waits, deadlocks
+		# and database restarts pass) until it runs out of attempts
+		attempts = cint(batch.attempts) + 1
+		values = {"attempts": attempts, "processed_at": now_datetime(), "error": str(e)}
+		if attempts < UPLOAD_MAX_ATTEMPTS:
+			delay = min(UPLOAD_RETRY_DELAY * 2 ** (attempts - 1), UPLOAD_MAX_RETRY_DELAY)
+			values.update(status="Queued", next_attempt_at=add_to_date(now_datetime(), seconds=delay))
+		else:
+			values.update(status="Failed", next_attempt_at=None)
+		frappe.db.set_value("ZK Upload Batch", name, values)
+		frappe.db.commit()
+		upload_batches_processed.inc(status="Retried" if values["status"] == "Queued" else "Failed")
+		frappe.logger().error(
+			f"Upload batch {name} from {batch.device_serial} failed (attempt {attempts}): {str(e)}"
+		)
+
+def parse_attendance_data(data):
+	"""Parse an ATTLOG body into a list of attendance records"""
+	return [record for kind, record in parse_upload("ATTLOG", iter_lines(io.StringIO(data)))]
+
+def insert_attendance(sn, record):
+	"""Insert a single ZK Log, and its Employee Checkin when the employee is known"""
+	zk_log = frappe.new_doc("ZK Log")
+	zk_log.device_serial = sn
+	zk_log.user_id = record["user_id"]
+	zk_log.timestamp = record["timestamp"]
+	zk_log.punch_type = record["punch_type"]
+	zk_log.punch_status = record.get("punch_status")
+	zk_log.verify_type = record.get("verify_type")
+	zk_log.work_code = record.get("work_code")
+	zk_log.raw_data = record["raw_data"]
+
+	# Find employee by device user ID
+	employee = find_employee_by_device_id(record["user_id"])
+	if employee:
+		# Name the checkin up front so the ZK Log is written once, already
+		# linked; the checkin itself is inserted next in this transaction
+		zk_log.employee_checkin = reserve_names("Employee Checkin", 1)[0]
+		zk_log.processed = 1
+		zk_log.flags.ignore_links = True
+
+	# The ZK Log goes first: its unique key makes a concurrent upload of the
+	# same punch fail here, before an Employee Checkin is made for it
+	try:
+		zk_log.insert(ignore_permissions=True)
+	except frappe.UniqueValidationError:
+		return
+
+	if employee:
+		checkin = frappe.new_doc("Employee Checkin")
+		checkin.employee = employee
+		checkin.time = record["timestamp"]
+		checkin.log_type = record["punch_type"]
+		checkin.device_id = sn
+		checkin.insert(ignore_permissions=True, set_name=zk_log.employee_checkin)
+
+def bulk_insert_attendance(sn, records):
+	"""Write ZK Log and Employee Checkin rows with multi-row inserts.
+
+	All rows are written in the current transaction; if anything fails the
+	whole batch is rolled back and the device is expected to resend it.
+	Employee Checkin shift fields are filled in as its controller would;
+	its other hooks (e.g. duplicate validation) are not run on this path.
+	"""
+	frappe.db.savepoint("zk_adms_bulk_ingest")
+	try:
+		employees = {}
+		for user_id in {record["user_id"] for record in records}:
+			employees[user_id] = find_employee_by_device_id(user_id)
+
+		checkin_rows = [i for i, record in enumerate(records) if employees.get(record["user_id"])]
+		checkin_by_row = dict(zip(checkin_rows, reserve_names("Employee Checkin", len(checkin_rows)), strict=True))
+
+		# ZK Logs go first with insert-ignore, so punches a concurrent upload
+		# stored in the meantime are skipped rather than checked in twice
+		log_names = bulk_insert_docs(
+			"ZK Log",
+			[
+				"device_serial", "user_id", "timestamp", "punch_type", "punch_status",
+				"verify_type", "work_code", "raw_data", "processed", "employee_checkin",
+			],
+			[
+				(
+					sn,
+					record["user_id"],
+					record["timestamp"],
+					record["punch_type"],
+					record.get("punch_status"),
+					record.get("verify_type"),
+					record.get("work_code"),
+					record["raw_data"],
+					1 if i in checkin_by_row else 0,
+					checkin_by_row.get(i),
+				)
+				for i, record in enumerate(records)
+			],
+			ignore_duplicates=True,
+		)
+
+		# Names are reserved for this batch only, so a name that exists now
+		# is a row this insert wrote
+		inserted = set(frappe.get_all(
+			"ZK Log",
+			filters={"name": ["in", [log_names[i] for i in checkin_rows]]},
+			pluck="name",
+		)) if checkin_rows else set()
+		checkin_rows = [i for i in checkin_rows if log_names[i] in inserted]
+
+		insert_checkins(
+			[
+				(employees[records[i]["user_id"]], records[i]["timestamp"], records[i]["punch_type"], sn)
+				for i in checkin_rows
+			],
+			names=[checkin_by_row[i] for i in checkin_rows],
+		)
+	except Exception as e:
+		frappe.db.rollback(save_point="zk_adms_bulk_ingest")
+		frappe.logger().error(f"Bulk ingest error for {sn}: {str(e)}")
+		raise BulkIngestError(str(e))
+
+@frappe.whitelist(methods=["POST"])
+def bulk_employee_checkin(checkins):
+	"""Insert a batch of Employee Checkins in one transaction.
+
+	Each row carries `employee` (or a device `user_id`), `time`, `log_type`
+	and `device_id`. Returns one result per row, in order, with `status`
+	set to Created, Duplicate or Failed. Created checkins carry the shift
+	fields HRMS auto attendance needs.
+	"""
+	frappe.has_permission("Employee Checkin", "create", throw=True)
+
+	checkins = frappe.parse_json(checkins) or []
+	results = [None] * len(checkins)
+	pending = []
+
+	for i, row in enumerate(checkins):
+		employee = row.get("employee") or find_employee_by_device_id(row.get("user_id"))
+		log_type = row.get("log_type")
+		try:
+			time = get_datetime(row.get("time"))
+		except Exception:
+			time = None
+
+		if not employee:
+			results[i] = {"status": "Failed", "error": f"No employee found for {row.get('user_id')}"}
+		elif not time:
+			results[i] = {"status": "Failed", "error": "Invalid time"}
+		elif log_type not in ("IN", "OUT"):
+			results[i] = {"status": "Failed", "error": f"Invalid log_type {log_type}"}
+		else:
+			pending.append((i, employee, time, log_type, row.get("device_id")))
+
+	# Rows already in ERPNext (e.g. a chunk resent after a timeout) count as synced
+	seen = {}
+	if pending:
+		for checkin in frappe.get_all(
+			"Employee Checkin",
+			filters={
+				"employee": ["in", list({row[1] for row in pending})],
+				"time": ["in", list({row[2] for row in pending})],
+			},
+			fields=["name", "employee", "time"],
+		):
+			seen[(checkin.employee, get_datetime(checkin.time))] = checkin.name
+
+	new_rows = []
+	for row in pending:
+		i, employee, time = row[:3]
+		if (employee, time) in seen:
+			results[i] = {"status": "Duplicate", "name": seen[(employee, time)]}
+		else:
+			seen[(employee, time)] = None
+			new_rows.append(row)
+
+	names = insert_checkins([row[1:] for row in new_rows])
+	for row, name in zip(new_rows, names, strict=True):
+		results[row[0]] = {"status": "Created", "name": name}
+
+	return results
+
+def insert_checkins(rows, names=None):
+	"""Bulk insert (employee, time, log_type, device_id) Employee Checkin rows with their shift fields.
+
+	HRMS auto attendance only picks up checkins linked to a shift, so the
+	shift fields are set the way Employee Checkin.fetch_shift sets them.
+	Returns the names in row order.
+	"""
+	shift_fields = [
+		field for field in CHECKIN_SHIFT_FIELDS if frappe.get_meta("Employee Checkin").has_field(field)
+	]
+	shifts = get_checkin_shifts(rows, shift_fields) if shift_fields else [()] * len(rows)
+	return bulk_insert_docs(
+		"Employee Checkin",
+		["employee", "time", "log_type", "device_id", *shift_fields],
+		[(*row, *shift) for row, shift in zip(rows, shifts, strict=True)],
+		names=names,
+	)
+
+def get_checkin_shifts(rows, fields):
+	"""Values of `fields` for each (employee, time, log_type, ...) row, as fetch_shift sets them.
+
+	An employee's punches mostly fall in the same shift, so a shift found
+	for one punch is reused for the employee's other punches inside its
+	actual start and end instead of being looked up again.
+	"""
+	found = {}
+	shifts = []
+	for employee, log_time, log_type, *_rest in rows:
+		shift = next(
+			(
+				shift for shift in found.get(employee, ())
+				if shift["shift_actual_start"] <= log_time <= shift["shift_actual_end"]
+			),
+			None,
+		)
+		if not shift:
+			checkin = frappe.new_doc("Employee Checkin")
+			checkin.employee = employee
+			checkin.time = log_time
+			checkin.log_type = log_type
+			checkin.fetch_shift()
+			shift = {field: checkin.get(field) for field in CHECKIN_SHIFT_FIELDS}
+			if shift["shift"] and shift["shift_actual_start"] and shift["shift_actual_end"]:
+				found.setdefault(employee, []).append(shift)
+		shifts.append(tuple(shift[field] for field in fields))
+	return shifts
+
+def bulk_insert_docs(doctype, fields, values, ignore_duplicates=False, names=None):
+	"""Insert rows for `doctype` with one multi-row INSERT per chunk.
+
+	Names and standard fields are filled in here since no Document objects
+	are created; pass `names` to use names reserved earlier. Returns the
+	names in row order.
+	"""
+	if not values:
+		return []
+
+	names = names or reserve_names(doctype, len(values))
+	now = now_datetime()
+	user = frappe.session.user
+	standard_fields = ["name", "owner", "creation", "modified", "modified_by"]
+	standard_values = [now, now, user]
+
+	naming_series = None
+	if frappe.get_meta(doctype).has_field("naming_series"):
+		naming_series = get_default_naming_series(doctype)
+		standard_fields.append("naming_series")
+
+	rows = []
+	for name, row in zip(names, values, strict=True):
+		standard = [name, user, *standard_values]
+		if naming_series is not None:
+			standard.append(naming_series)
+		rows.append((*standard, *row))
+
+	frappe.db.bulk_insert(doctype, standard_fields + list(fields), rows, ignore_duplicates=ignore_duplicates)
+	return names
+
+def get_default_naming_series(doctype):
+	"""Return the first naming series option for `doctype`"""
+	options = frappe.get_meta(doctype).get_field("naming_series").options or ""
+	return options.split("\n")[0].strip()
+
+def reserve_names(doctype, count):
+	"""Reserve `count` names for `doctype` with a single series update"""
+	meta = frappe.get_meta(doctype)
+	series = meta.autoname or ""
+	if series.startswith("naming_series:"):
+		series = get_default_naming_series(doctype)
+		if series and "#" not in series:
+			series = f"{series}.#####"
+
+	if "#" not in series or series.startswith(("field:", "format:", "hash", "prompt")):
+		return [frappe.generate_hash(length=10) for _ in range(count)]
+
+	prefix, digits = series.rsplit(".", 1)
+	prefix = parse_naming_series(prefix)
+	start = reserve_series(prefix, count)
+	return [f"{prefix}{n:0{len(digits)}d}" for n in range(start, start + count)]
+
+def reserve_series(prefix, count):
+	"""Advance the `tabSeries` counter for `prefix` by `count` and return the first number"""
+	current = frappe.db.sql("select `current` from `tabSeries` where `name`=%s for update", (prefix,))
+	if current and current[0][0] is not None:
+		frappe.db.sql("update `tabSeries` set `current` = `current` + %s where `name`=%s", (count, prefix))
+		return cint(current[0][0]) + 1
+
+	frappe.db.sql("insert into `tabSeries` (`name`, `current`) values (%s, %s)", (prefix, count))
+	return 1
+
 def find_employee_by_device_id(device_user_id):
 	"""Find employee by device user ID"""
-	# Check if Employee has device_user_id custom field
-	if frappe.db.has_column("Employee", "device_user_id"):
-		employee = frappe.db.get_value("Employee", {"device_user_id": device_user_id}, "name")
-		if employee:
-			return employee
-	
-	# Fallback: try to match by employee_number or name
-	employee = frappe.db.get_value("Employee", {"employee_number": device_user_id}, "name")
-	if employee:
-		return employee
-		
-	return None
\ No newline at end of file
+	return get_employee_map().get(str(device_user_id))
@@ -0,0 +1,126 @@
+from urllib.parse import parse_qsl
+
+import frappe  # type: ignore
+from frappe.utils import cint, now_datetime  # type: ignore
+
+# Commands handed to a device per getrequest poll
+MAX_COMMANDS_PER_REQUEST = 10
+
+# Options sent in reply to the options=all handshake. Realtime push with a
+# one-minute TransInterval keeps uploads small and steady instead of bursty.
+DEFAULT_DEVICE_OPTIONS = {
+	"ErrorDelay": 30,
+	"Delay": 10,
+	"TransTimes": "00:00;14:05",
+	"TransInterval": 1,
+	"TransFlag": "TransData AttLog OpLog",
+	"Realtime": 1,
+	"Encrypt": "None",
+}
+
+def queue_key(sn):
+	return f"zk_adms:device_commands:{sn}"
+
+def push_command(sn, name):
+	"""Append a command id to the device's Redis queue"""
+	frappe.cache().rpush(queue_key(sn), str(name))
+
+def pop_commands(sn):
+	"""Take up to MAX_COMMANDS_PER_REQUEST pending commands for a device and mark them Sent"""
+	names = []
+	for _ in range(MAX_COMMANDS_PER_REQUEST):
+		name = frappe.cache().lpop(queue_key(sn))
+		if name is None:
+			break
+		names.append(cint(name))
+
+	if not names:
+		return []
+
+	# Skip ids whose command was deleted or already handled
+	commands = frappe.get_all(
+		"Attendance Device Command",
+		filters={"name": ["in", names], "device": sn, "status": "Pending"},
+		fields=["name", "command"],
+		order_by="name asc"
+	)
+	if commands:
+		command = frappe.qb.DocType("Attendance Device Command")
+		(
+			frappe.qb.update(command)
+			.set(command.status, "Sent")
+			.set(command.sent_at, now_datetime())
+			.where(command.name.isin([row.name for row in commands]))
+			.run()
+		)
+
+	return commands
+
+def get_command_response(sn):
+	"""Build the getrequest reply: one C:<id>:<cmd> line per pending command, else OK"""
+	commands = pop_commands(sn)
+	if not commands:
+		return "OK"
+
+	return "\n".join(f"C:{row.name}:{row.command}" for row in commands) + "\n"
+
+def record_command_results(sn, data):
+	"""Store devicecmd results; each line looks like ID=<id>&Return=<code>&CMD=<cmd>"""
+	now = now_datetime()
+	for line in data.splitlines():
+		result = dict(parse_qsl(line.strip()))
+		if not result.get("ID"):
+			continue
+
+		name = cint(result["ID"])
+		if not frappe.db.exists("Attendance Device Command", {"name": name, "device": sn}):
+			continue
+
+		return_code = result.get("Return", "")
+		frappe.db.set_value("Attendance Device Command", name, {
+			"status": "Succeeded" if cint(return_code) >= 0 else "Failed",
+			"return_code": return_code,
+			"result": line.strip(),
+			"completed_at": now,
+		})
+
+def get_handshake_response(sn):
+	"""Reply to the GET cdata?options=all handshake with the device options"""
+	options = dict(DEFAULT_DEVICE_OPTIONS)
+	options.update(frappe.conf.get("zk_adms_device_options") or {})
+
+	# Stamps tell the device where to resume, so reconnects don't resend everything
+	stamps = frappe.db.get_value("Attendance Device", sn, ["attlog_stamp", "operlog_stamp"], as_dict=True) or {}
+
+	lines = [
+		f"GET OPTION FROM: {sn}",
+		f"ATTLOGStamp={stamps.get('attlog_stamp') or 'None'}",
+		f"OPERLOGStamp={stamps.get('operlog_stamp') or 'None'}",
+	]
+	lines.extend(f"{key}={value}" for key, value in options.items())
+	return "\n".join(lines) + "\n"
+
+@frappe.whitelist()
+def queue_device_command(device, command):
+	"""Queue a command for a device; it is sent on the device's next getrequest"""
+	doc = frappe.new_doc("Attendance Device Command")
+	doc.device = device
+	doc.command = command
+	doc.insert()
+	return doc.name
+
+def requeue_pending_commands():
+	"""Re-add Pending commands missing from Redis (e.g. after a cache flush)"""
+	pending = frappe.get_all(
+		"Attendance Device Command",
+		filters={"status": "Pending"},
+		fields=["name", "device"],
+		order_by="name asc"
+	)
+
+	queued = {}
+	for row in pending:
+		if row.device not in queued:
+			queued[row.device] = {cint(name) for name in frappe.cache().lrange(queue_key(row.device), 0, -1)}
+		if row.name not in queued[row.device]:
+			push_command(row.device, row.name)
@@ -0,0 +1,85 @@
+import json
+import random
+
+import frappe  # type: ignore
+from frappe.utils import cint, flt, now_datetime  # type: ignore
+
+CAPTURE_DEVICES_KEY = "zk_adms:debug_capture_devices"
+CAPTURE_BUFFER_KEY = "zk_adms:debug_capture"
+
+# Defaults for the zk_adms_debug_* site config keys
+CAPTURE_BUFFER_SIZE = 200
+CAPTURE_BODY_LIMIT = 64 * 1024
+
+def get_capture_devices():
+	"""Serial numbers with Debug Capture enabled, cached until a device is saved"""
+	return frappe.cache().get_value(
+		CAPTURE_DEVICES_KEY,
+		generator=lambda: set(frappe.get_all("Attendance Device", filters={"debug_capture": 1}, pluck="name")),
+	)
+
+def clear_capture_cache(doc=None, method=None):
+	frappe.cache().delete_value(CAPTURE_DEVICES_KEY)
+
+def is_capture_enabled(sn):
+	"""Whether requests from this device are captured in full (and raw_data kept on ZK Log)"""
+	return bool(sn) and sn in get_capture_devices()
+
+def should_capture(sn):
+	"""Capture enabled devices always, others at zk_adms_debug_sample_rate (0 to 1, default off)"""
+	if is_capture_enabled(sn):
+		return True
+	sample_rate = flt(frappe.conf.get("zk_adms_debug_sample_rate"))
+	return sample_rate > 0 and random.random() < sample_rate
+
+def log_request(sn, response, elapsed):
+	"""Write one compact access line per iclock request, and capture it when due"""
+	request = frappe.request
+	elapsed_ms = elapsed * 1000
+	outcome = str(response).split(":", 1)[0].split("\n", 1)[0]
+
+	if cint(frappe.conf.get("zk_adms_access_log", 1)):
+		frappe.logger("zk_adms.access").info(
+			f"{request.method} {request.path} sn={sn or '-'} table={frappe.form_dict.get('table') or '-'} "
+			f"bytes={request.content_length or 0} result={outcome} ms={elapsed_ms:.1f}"
+		)
+
+	if should_capture(sn):
+		capture_request(sn, response, elapsed_ms)
+
+def capture_request(sn, response, elapsed_ms):
+	"""Push the request to a size-capped Redis ring buffer, newest first"""
+	request = frappe.request
+	body_limit = cint(frappe.conf.get("zk_adms_debug_body_limit")) or CAPTURE_BODY_LIMIT
+	buffer_size = cint(frappe.conf.get("zk_adms_debug_buffer_size")) or CAPTURE_BUFFER_SIZE
+	body = request.get_data()
+
+	entry = {
+		"timestamp": now_datetime(),
+		"device": sn,
+		"method": request.method,
+		"url": request.url,
+		"headers": dict(request.headers),
+		"body": body[:body_limit].decode("utf-8", "replace"),
+		"body_bytes": len(body),
+		"response": str(response)[:body_limit],
+		"elapsed_ms": round(elapsed_ms, 1),
+	}
+	cache = frappe.cache()
+	cache.lpush(CAPTURE_BUFFER_KEY, json.dumps(entry, default=str))
+	cache.ltrim(CAPTURE_BUFFER_KEY, 0, buffer_size - 1)
+
+@frappe.whitelist()
+def get_captured_requests(device=None, limit=50):
+	"""Return captured requests, newest first, optionally for one device"""
+	frappe.only_for("System Manager")
+
+	entries = [json.loads(entry) for entry in frappe.cache().lrange(CAPTURE_BUFFER_KEY, 0, -1)]
+	if device:
+		entries = [entry for entry in entries if entry["device"] == device]
+	return entries[:cint(limit)]
+
+@frappe.whitelist(methods=["POST"])
+def clear_captured_requests():
+	frappe.only_for("System Manager")
+	frappe.cache().delete_value(CAPTURE_BUFFER_KEY)
@@ -0,0 +1,61 @@
+import frappe  # type: ignore
+
+EMPLOYEE_MAP_KEY = "zk_adms:employee_by_device_user_id"
+HAS_DEVICE_USER_ID_KEY = "zk_adms:employee_has_device_user_id"
+
+def get_employee_map():
+	"""Return the device_user_id -> Employee mapping for the current site.
+
+	Loaded with one query and kept in the site cache; Employee doc_events
+	clear it so the next lookup reloads it in bulk.
+	"""
+	if getattr(frappe.local, "zk_adms_employee_map", None) is None:
+		frappe.local.zk_adms_employee_map = frappe.cache().get_value(
+			EMPLOYEE_MAP_KEY, generator=load_employee_map
+		)
+	return frappe.local.zk_adms_employee_map
+
+def load_employee_map():
+	"""Build the mapping from Employee, preferring device_user_id over employee_number"""
+	fields = ["name", "employee_number"]
+	if has_device_user_id_column():
+		fields.append("device_user_id")
+
+	employee_map = {}
+	employees = frappe.get_all("Employee", fields=fields, order_by="creation asc")
+
+	# Fallback: match by employee_number
+	for employee in employees:
+		if employee.employee_number:
+			employee_map.setdefault(str(employee.employee_number), employee.name)
+
+	# device_user_id always wins over an employee_number match
+	for employee in employees:
+		if employee.get("device_user_id"):
+			employee_map[str(employee.device_user_id)] = employee.name
+
+	return employee_map
+
+def has_device_user_id_column():
+	"""Check once per site whether Employee has the device_user_id custom field.
+
+	Cleared after migrate and when an Employee Custom Field changes.
+	"""
+	return frappe.cache().get_value(
+		HAS_DEVICE_USER_ID_KEY, generator=lambda: frappe.db.has_column("Employee", "device_user_id")
+	)
+
+def clear_employee_cache(doc=None, method=None):
+	"""Employee doc_event: drop the cached mapping so it is reloaded on next use"""
+	frappe.cache().delete_value(EMPLOYEE_MAP_KEY)
+	frappe.local.zk_adms_employee_map = None
+
+def clear_column_cache():
+	"""Forget the cached device_user_id column check (after custom field changes)"""
+	frappe.cache().delete_value(HAS_DEVICE_USER_ID_KEY)
+	clear_employee_cache()
+
+def clear_column_cache_for_field(doc, method=None):
+	"""Custom Field doc_event: recheck the column when an Employee field is added or removed"""
+	if doc.dt == "Employee":
+		clear_column_cache()
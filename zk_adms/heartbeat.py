@@ -0,0 +1,110 @@
+import frappe  # type: ignore
+from frappe.query_builder import Case  # type: ignore
+from frappe.utils import now_datetime  # type: ignore
+
+HEARTBEAT_KEY = "zk_adms:device_heartbeat"
+HEARTBEAT_FIELDS = ("status", "last_sync_time", "ip_address")
+
+# Devices written per UPDATE statement by flush_heartbeats
+FLUSH_CHUNK_SIZE = 500
+
+# Devices known to exist, per site, for the life of this worker process
+known_devices = set()
+
+def record_heartbeat(sn):
+	"""Record a device heartbeat in Redis instead of saving the Attendance Device.
+
+	Only the first contact from an unknown device touches the database;
+	flush_heartbeats writes the latest state back periodically.
+	"""
+	ensure_device(sn)
+	frappe.cache().hset(HEARTBEAT_KEY, sn, {
+		"status": "Online",
+		"last_sync_time": now_datetime(),
+		"ip_address": frappe.local.request_ip,
+	})
+
+def ensure_device(sn):
+	"""Create the Attendance Device on first contact"""
+	key = (frappe.local.site, sn)
+	if key in known_devices:
+		return
+
+	if not frappe.db.exists("Attendance Device", sn):
+		device = frappe.new_doc("Attendance Device")
+		device.serial_number = sn
+		device.device_name = f"ZKTeco Device {sn}"
+		device.status = "Online"
+		device.last_sync_time = now_datetime()
+		device.ip_address = frappe.local.request_ip
+		device.insert(ignore_permissions=True)
+		record_status_changes([sn], "Online", device.last_sync_time)
+
+	known_devices.add(key)
+
+def flush_heartbeats():
+	"""Write buffered heartbeats to Attendance Device, only where values changed"""
+	# Redis returns hash keys as bytes
+	heartbeats = {
+		frappe.safe_decode(key): heartbeat for key, heartbeat in frappe.cache().hgetall(HEARTBEAT_KEY).items()
+	}
+	if not heartbeats:
+		return
+
+	devices = {
+		device.name: device
+		for device in frappe.get_all(
+			"Attendance Device",
+			filters={"name": ["in", list(heartbeats)]},
+			fields=["name", "status", "last_sync_time", "ip_address"]
+		)
+	}
+
+	updates = {}
+	came_online = []
+	for sn, heartbeat in heartbeats.items():
+		device = devices.get(sn)
+		if not device:
+			# Device was deleted; forget it
+			frappe.cache().hdel(HEARTBEAT_KEY, sn)
+			continue
+
+		# Nothing new since the last flush (or the device was marked offline since)
+		if device.last_sync_time and heartbeat["last_sync_time"] <= device.last_sync_time:
+			continue
+
+		if any(device.get(field) != heartbeat.get(field) for field in HEARTBEAT_FIELDS):
+			updates[sn] = heartbeat
+			if device.status != heartbeat["status"] and heartbeat["status"] == "Online":
+				came_online.append((sn, heartbeat["last_sync_time"]))
+
+	write_heartbeats(updates)
+	for sn, timestamp in came_online:
+		record_status_changes([sn], "Online", timestamp)
+
+def write_heartbeats(updates):
+	"""Set the heartbeat fields of many devices with one UPDATE ... CASE per chunk"""
+	device = frappe.qb.DocType("Attendance Device")
+	names = list(updates)
+	for start in range(0, len(names), FLUSH_CHUNK_SIZE):
+		chunk = names[start:start + FLUSH_CHUNK_SIZE]
+		query = frappe.qb.update(device).where(device.name.isin(chunk))
+		for field in HEARTBEAT_FIELDS:
+			value = Case()
+			for sn in chunk:
+				value = value.when(device.name == sn, updates[sn].get(field))
+			query = query.set(device[field], value.else_(device[field]))
+		query.run()
+
+def record_status_changes(devices, status, timestamp):
+	"""Append Online/Offline transitions to Attendance Device Status Log in one insert"""
+	if not devices:
+		return
+
+	now = now_datetime()
+	user = frappe.session.user
+	frappe.db.bulk_insert(
+		"Attendance Device Status Log",
+		["device", "status", "timestamp", "owner", "creation", "modified", "modified_by"],
+		[(device, status, timestamp, user, now, now, user) for device in devices]
+	)
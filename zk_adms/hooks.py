@@ -8,7 +8,8 @@ app_license = "mit"
 # Apps
 # ------------------
 
-# required_apps = []
+# Employee comes from ERPNext and Employee Checkin from HRMS
+required_apps = ["erpnext", "hrms"]
 
 # Each item in the list will be shown as an app in the apps page
 # add_to_apps_screen = [
@@ -85,6 +86,9 @@ app_license = "mit"
 # before_install = "zk_adms.install.before_install"
 # after_install = "zk_adms.install.after_install"
 
+# Migrations may add or drop Employee.device_user_id
+after_migrate = "zk_adms.employee_cache.clear_column_cache"
+
 # Uninstallation
 # ------------
 
@@ -137,23 +141,34 @@ app_license = "mit"
 # ---------------
 # Hook on document methods and events
 
-# doc_events = {
-# 	"*": {
-# 		"on_update": "method",
-# 		"on_cancel": "method",
-# 		"on_trash": "method"
-# 	}
-# }
+doc_events = {
+	"Employee": {
+		"on_update": "zk_adms.employee_cache.clear_employee_cache",
+		"after_rename": "zk_adms.employee_cache.clear_employee_cache",
+		"on_trash": "zk_adms.employee_cache.clear_employee_cache"
+	},
+	"Custom Field": {
+		"on_update": "zk_adms.employee_cache.clear_column_cache_for_field",
+		"on_trash": "zk_adms.employee_cache.clear_column_cache_for_field"
+	}
+}
 
 # Scheduled Tasks
 # ---------------
 
 scheduler_events = {
 	"cron": {
-		"*/5 * * * *": [
-			"zk_adms.tasks.mark_offline_devices"
+		"* * * * *": [
+			"zk_adms.tasks.mark_offline_devices",
+			"zk_adms.tasks.enqueue_queued_uploads"
 		]
-	}
+	},
+	"hourly": [
+		"zk_adms.commands.requeue_pending_commands"
+	],
+	"daily": [
+		"zk_adms.tasks.purge_processed_uploads"
+	]
 }
 
 # Testing
@@ -230,6 +245,7 @@ website_route_rules = [
 	{"from_route": "/iclock", "to_route": "zk_adms.api.iclock"},
 	{"from_route": "/iclock/cdata", "to_route": "zk_adms.api.iclock"},
 	{"from_route": "/iclock/getrequest", "to_route": "zk_adms.api.iclock"},
+	{"from_route": "/iclock/devicecmd", "to_route": "zk_adms.api.iclock"},
 ]
 
 # Custom Fields
@@ -1,5 +1,7 @@
 import frappe
 
+from zk_adms.employee_cache import clear_column_cache
+
 def after_install():
 	"""Run after app installation"""
 	fix_employee_image_field()
@@ -28,4 +30,6 @@ def create_custom_fields():
 		custom_field.label = "Device User ID"
 		custom_field.insert_after = "employee_number"
 		custom_field.description = "User ID from ZKTeco attendance device"
-		custom_field.insert(ignore_permissions=True)
\ No newline at end of file
+		custom_field.insert(ignore_permissions=True)
+
+	clear_column_cache()
\ No newline at end of file
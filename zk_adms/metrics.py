@@ -0,0 +1,150 @@
+"""Counters, histograms and gauges rendered in the Prometheus text format.
+
+Nothing here depends on Frappe. Values live in a store: MemoryStore for a
+single process (the standalone ADMS server), or a shared store such as the
+Redis one in zk_adms.site_metrics when several workers report together.
+"""
+
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+# Seconds; covers fast heartbeats up to multi-minute backlog uploads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+class MemoryStore:
+	"""Thread-safe in-process sample store"""
+
+	def __init__(self):
+		self.lock = Lock()
+		self.values = {}
+
+	def inc(self, increments):
+		with self.lock:
+			for key, amount in increments.items():
+				self.values[key] = self.values.get(key, 0) + amount
+
+	def items(self):
+		with self.lock:
+			return dict(self.values)
+
+def format_labels(labels):
+	if not labels:
+		return ""
+	pairs = []
+	for name in sorted(labels):
+		value = str(labels[name]).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+		pairs.append(f'{name}="{value}"')
+	return "{" + ",".join(pairs) + "}"
+
+def format_value(value):
+	value = float(value)
+	return str(int(value)) if value.is_integer() else repr(value)
+
+class Counter:
+	def __init__(self, registry, name, documentation):
+		self.registry = registry
+		self.name = name
+		self.documentation = documentation
+
+	def inc(self, amount=1, **labels):
+		if amount:
+			self.registry.store.inc({f"{self.name}|{format_labels(labels)}": amount})
+
+	def render(self, samples):
+		lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+		for labels, value in sorted(samples.get(self.name, {}).items()):
+			lines.append(f"{self.name}{labels} {format_value(value)}")
+		return lines
+
+class Histogram:
+	def __init__(self, registry, name, documentation, buckets=DEFAULT_BUCKETS):
+		self.registry = registry
+		self.name = name
+		self.documentation = documentation
+		self.buckets = tuple(sorted(buckets))
+
+	def observe(self, value, **labels):
+		"""Record one value; only its own bucket is stored, cumulative counts are built on render"""
+		label_text = format_labels(labels)
+		bucket = next((str(bound) for bound in self.buckets if value <= bound), "+Inf")
+		self.registry.store.inc({
+			f"{self.name}_bucket:{bucket}|{label_text}": 1,
+			f"{self.name}_sum|{label_text}": value,
+			f"{self.name}_count|{label_text}": 1,
+		})
+
+	@contextmanager
+	def time(self, **labels):
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(time.perf_counter() - started, **labels)
+
+	def render(self, samples):
+		lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+		counts = samples.get(f"{self.name}_count", {})
+		for label_text in sorted(counts):
+			inner = label_text[1:-1]
+			cumulative = 0
+			for bound in self.buckets:
+				cumulative += samples.get(f"{self.name}_bucket:{bound}", {}).get(label_text, 0)
+				le = f'le="{bound}"'
+				lines.append(f"{self.name}_bucket{{{inner + ',' if inner else ''}{le}}} {format_value(cumulative)}")
+			lines.append(f"{self.name}_bucket{{{inner + ',' if inner else ''}le=\"+Inf\"}} {format_value(counts[label_text])}")
+			lines.append(f"{self.name}_sum{label_text} {format_value(samples[f'{self.name}_sum'][label_text])}")
+			lines.append(f"{self.name}_count{label_text} {format_value(counts[label_text])}")
+		return lines
+
+class Gauge:
+	"""Value read when metrics are rendered, e.g. a backlog count from the database"""
+
+	def __init__(self, registry, name, documentation, collect):
+		self.registry = registry
+		self.name = name
+		self.documentation = documentation
+		self.collect = collect
+
+	def render(self, samples):
+		lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+		try:
+			values = self.collect()
+		except Exception:
+			# A failing source should not break the rest of the scrape
+			return lines
+		if not isinstance(values, dict):
+			values = {(): values}
+		for labels, value in values.items():
+			lines.append(f"{self.name}{format_labels(dict(labels))} {format_value(value)}")
+		return lines
+
+class Registry:
+	def __init__(self, store=None):
+		self.store = store or MemoryStore()
+		self.metrics = []
+
+	def counter(self, name, documentation):
+		return self.register(Counter(self, name, documentation))
+
+	def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+		return self.register(Histogram(self, name, documentation, buckets))
+
+	def gauge(self, name, documentation, collect):
+		return self.register(Gauge(self, name, documentation, collect))
+
+	def register(self, metric):
+		self.metrics.append(metric)
+		return metric
+
+	def render(self):
+		"""All metrics in the Prometheus text exposition format"""
+		samples = {}
+		for key, value in self.store.items().items():
+			series, _, label_text = key.partition("|")
+			samples.setdefault(series, {})[label_text] = value
+
+		lines = []
+		for metric in self.metrics:
+			lines.extend(metric.render(samples))
+		return "\n".join(lines) + "\n"
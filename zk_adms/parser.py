@@ -0,0 +1,137 @@
+"""Parser for ADMS cdata uploads.
+
+Uploads are read line by line and turned into (kind, record) tuples, where
+kind is "attendance", "operation", "user" or "fingerprint". Nothing here
+depends on Frappe, so the standalone ADMS server can use it as well.
+"""
+
+from datetime import datetime
+
+# ATTLOG status column
+PUNCH_STATUS = {
+	0: "Check In",
+	1: "Check Out",
+	2: "Break Out",
+	3: "Break In",
+	4: "Overtime In",
+	5: "Overtime Out",
+}
+IN_STATUSES = {0, 3, 4}
+
+# ATTLOG verify column
+VERIFY_TYPES = {
+	0: "Password",
+	1: "Fingerprint",
+	2: "Card",
+	15: "Face",
+	25: "Palm",
+}
+
+def iter_lines(stream):
+	"""Yield non-empty lines from a text or binary stream, without the line ending"""
+	for line in stream:
+		if isinstance(line, bytes):
+			line = line.decode("utf-8", "replace")
+		line = line.rstrip("\r\n")
+		if line.strip():
+			yield line
+
+def parse_timestamp(value):
+	"""Parse a fixed-format "YYYY-MM-DD HH:MM:SS" timestamp without strptime"""
+	if len(value) != 19 or value[4] != "-" or value[7] != "-" or value[10] != " " or value[13] != ":" or value[16] != ":":
+		raise ValueError(f"Invalid timestamp: {value}")
+	return datetime(
+		int(value[0:4]), int(value[5:7]), int(value[8:10]),
+		int(value[11:13]), int(value[14:16]), int(value[17:19])
+	)
+
+def to_int(value, default=None):
+	try:
+		return int(value)
+	except (TypeError, ValueError):
+		return default
+
+def parse_attlog_line(line):
+	"""USER_ID \\t TIMESTAMP \\t STATUS \\t VERIFY \\t WORKCODE ..."""
+	parts = line.split("\t")
+	if len(parts) < 3:
+		return None
+
+	try:
+		timestamp = parse_timestamp(parts[1].strip())
+	except ValueError:
+		return None
+
+	status = to_int(parts[2])
+	verify = to_int(parts[3]) if len(parts) > 3 else None
+	return {
+		"user_id": parts[0].strip(),
+		"timestamp": timestamp,
+		"punch_type": "IN" if status in IN_STATUSES else "OUT",
+		"punch_status": PUNCH_STATUS.get(status, parts[2]),
+		"verify_type": VERIFY_TYPES.get(verify, f"Other ({parts[3]})") if verify is not None else None,
+		"work_code": parts[4].strip() if len(parts) > 4 else None,
+		"raw_data": line,
+	}
+
+def parse_key_values(text):
+	"""Parse "KEY=value\\tKEY=value" pairs as used by USER and FP lines"""
+	values = {}
+	for pair in text.split("\t"):
+		key, sep, value = pair.partition("=")
+		if sep:
+			values[key.strip()] = value
+	return values
+
+def parse_user_line(text):
+	values = parse_key_values(text)
+	if not values.get("PIN"):
+		return None
+	return {
+		"user_id": values["PIN"],
+		"user_name": values.get("Name"),
+		"privilege": values.get("Pri"),
+		"card_number": values.get("Card"),
+	}
+
+def parse_oplog_line(text):
+	"""OPLOG CODE \\t ADMIN \\t TIMESTAMP \\t OBJECT1 ..."""
+	parts = text.split("\t")
+	if len(parts) < 3:
+		return None
+	try:
+		timestamp = parse_timestamp(parts[2].strip())
+	except ValueError:
+		return None
+	return {
+		"operation": parts[0].strip(),
+		"admin_id": parts[1].strip(),
+		"timestamp": timestamp,
+		"objects": [part.strip() for part in parts[3:]],
+	}
+
+def parse_operlog_line(line):
+	"""OPERLOG/USERINFO lines are prefixed with their record type"""
+	record_type, _, rest = line.partition(" ")
+	if record_type == "USER":
+		record = parse_user_line(rest)
+		return ("user", record) if record else None
+	if record_type == "OPLOG":
+		record = parse_oplog_line(rest)
+		return ("operation", record) if record else None
+	if record_type in ("FP", "BIODATA"):
+		return ("fingerprint", parse_key_values(rest))
+	return None
+
+def parse_upload(table, lines):
+	"""Yield (kind, record) tuples for the lines of a cdata upload of `table`"""
+	table = (table or "ATTLOG").upper()
+	for line in lines:
+		if table == "ATTLOG":
+			record = parse_attlog_line(line)
+			if record:
+				yield "attendance", record
+		elif table in ("OPERLOG", "USERINFO"):
+			parsed = parse_operlog_line(line)
+			if parsed:
+				yield parsed
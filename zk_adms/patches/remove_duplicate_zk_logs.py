@@ -0,0 +1,28 @@
+import frappe
+
+def execute():
+    """Remove duplicate ZK Logs so the (device_serial, user_id, timestamp) unique key can be added"""
+    if not frappe.db.table_exists("ZK Log"):
+        return
+
+    duplicates = frappe.db.sql("""
+        SELECT device_serial, user_id, timestamp
+        FROM `tabZK Log`
+        GROUP BY device_serial, user_id, timestamp
+        HAVING COUNT(*) > 1
+    """, as_dict=True)
+
+    for row in duplicates:
+        # Keep the processed row if there is one, otherwise the oldest
+        names = frappe.get_all("ZK Log",
+            filters={
+                "device_serial": row.device_serial,
+                "user_id": row.user_id,
+                "timestamp": row.timestamp
+            },
+            order_by="processed desc, creation asc",
+            pluck="name"
+        )
+        frappe.db.delete("ZK Log", {"name": ["in", names[1:]]})
+
+    frappe.db.commit()
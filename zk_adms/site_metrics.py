@@ -0,0 +1,61 @@
+import frappe  # type: ignore
+
+from zk_adms.metrics import Registry
+
+METRICS_KEY = "zk_adms:metrics"
+
+class RedisStore:
+	"""Samples kept in one Redis hash, so all web and background workers add up"""
+
+	def inc(self, increments):
+		# Best effort: a Redis hiccup must not fail the upload being measured
+		try:
+			cache = frappe.cache()
+			pipeline = cache.pipeline()
+			for key, amount in increments.items():
+				pipeline.hincrbyfloat(cache.make_key(METRICS_KEY), key, amount)
+			pipeline.execute()
+		except Exception as e:
+			frappe.logger().warning(f"Could not record metrics: {str(e)}")
+
+	def items(self):
+		# Read through a raw pipeline: RedisWrapper.hgetall would unpickle the values
+		cache = frappe.cache()
+		pipeline = cache.pipeline()
+		pipeline.hgetall(cache.make_key(METRICS_KEY))
+		values = pipeline.execute()[0]
+		return {key.decode(): float(value) for key, value in values.items()}
+
+registry = Registry(RedisStore())
+
+iclock_request_seconds = registry.histogram(
+	"zk_adms_iclock_request_seconds", "iclock request latency by endpoint and upload table"
+)
+records_parsed = registry.counter("zk_adms_records_parsed_total", "Attendance records parsed, by device")
+records_inserted = registry.counter("zk_adms_records_inserted_total", "New ZK Logs stored, by device")
+records_duplicate = registry.counter(
+	"zk_adms_records_duplicate_total", "Re-uploaded attendance records skipped, by device"
+)
+db_write_seconds = registry.histogram(
+	"zk_adms_db_write_seconds", "Time to write an upload's ZK Logs and Employee Checkins, by path"
+)
+db_commit_seconds = registry.histogram("zk_adms_db_commit_seconds", "Commit time of background upload batches")
+upload_batches_processed = registry.counter(
+	"zk_adms_upload_batches_total", "Background upload batches processed, by status"
+)
+registry.gauge(
+	"zk_adms_upload_batches_queued",
+	"ZK Upload Batches waiting for the ingest job",
+	lambda: frappe.db.count("ZK Upload Batch", {"status": "Queued"}),
+)
+
+@frappe.whitelist()
+def metrics():
+	"""Prometheus scrape endpoint: /api/method/zk_adms.site_metrics.metrics"""
+	frappe.only_for("System Manager")
+	frappe.response["type"] = "txt"
+	frappe.response["doctype"] = "metrics"
+	frappe.response["result"] = registry.render()
+
+def reset_metrics():
+	frappe.cache().delete_value(METRICS_KEY)
@@ -1,22 +1,64 @@
 import frappe
+from frappe.utils import cint, now_datetime
 from datetime import datetime, timedelta
 
+from zk_adms.api import due_upload_filters, enqueue_device_batches
+from zk_adms.heartbeat import flush_heartbeats, record_status_changes
+
+# Seconds without a heartbeat before a device is marked offline
+OFFLINE_AFTER_SECONDS = 180
+
 def mark_offline_devices():
-	"""Mark devices as offline if no heartbeat for 5 minutes"""
-	cutoff_time = datetime.now() - timedelta(minutes=5)
-	
-	devices = frappe.get_all("Attendance Device", 
+	"""Mark devices as offline if no heartbeat within the configured threshold"""
+	# Apply buffered heartbeats first so recently seen devices stay online
+	flush_heartbeats()
+
+	threshold = cint(frappe.conf.get("zk_adms_offline_after_seconds") or OFFLINE_AFTER_SECONDS)
+	now = now_datetime()
+	cutoff_time = now - timedelta(seconds=threshold)
+
+	# Lock the stale rows so a heartbeat flush cannot bring one back Online
+	# between this select and the update, which would log a false transition
+	devices = frappe.get_all("Attendance Device",
 		filters={
 			"status": "Online",
 			"last_sync_time": ["<", cutoff_time]
 		},
-		fields=["name"]
+		pluck="name",
+		for_update=True
+	)
+	if not devices:
+		return
+
+	device = frappe.qb.DocType("Attendance Device")
+	(
+		frappe.qb.update(device)
+		.set(device.status, "Offline")
+		.where(device.name.isin(devices))
+		.where(device.status == "Online")
+		.run()
 	)
-	
-	for device in devices:
-		doc = frappe.get_doc("Attendance Device", device.name)
-		doc.status = "Offline"
-		doc.save(ignore_permissions=True)
-	
-	if devices:
-		frappe.logger().info(f"Marked {len(devices)} devices as offline")
\ No newline at end of file
+	record_status_changes(devices, "Offline", now)
+
+	frappe.logger().info(f"Marked {len(devices)} devices as offline")
+
+def enqueue_queued_uploads():
+	"""Make sure every device with queued uploads due for processing has an ingest job"""
+	devices = frappe.get_all(
+		"ZK Upload Batch",
+		filters={"status": "Queued"},
+		or_filters=due_upload_filters(),
+		distinct=True,
+		pluck="device_serial"
+	)
+
+	for sn in devices:
+		enqueue_device_batches(sn)
+
+def purge_processed_uploads():
+	"""Delete processed upload batches older than the retention period"""
+	days = cint(frappe.conf.get("zk_adms_upload_retention_days") or 7)
+	frappe.db.delete("ZK Upload Batch", {
+		"status": "Processed",
+		"processed_at": ["<", datetime.now() - timedelta(days=days)]
+	})
@@ -23,4 +23,159 @@ class TestZKTECOAPI(unittest.TestCase):
 		
 		# Check if ZK Log entries were created
 		logs = frappe.get_all("ZK Log", filters={"device_serial": sn})
-		self.assertEqual(len(logs), 2)
\ No newline at end of file
+		self.assertEqual(len(logs), 2)
+
+	def test_bulk_attendance_processing(self):
+		"""Test multi-row insert path for large uploads"""
+		from erpnext.setup.doctype.employee.test_employee import make_employee
+		from zk_adms.employee_cache import clear_employee_cache
+
+		sn = "TESTBULK0001"
+		employee = make_employee("zk_adms_bulk@example.com")
+		frappe.db.set_value("Employee", employee, "device_user_id", "B001")
+		clear_employee_cache()
+		test_data = "\n".join(
+			f"B{i:03d}\t2024-01-02 09:{i % 60:02d}:00\t0\t1" for i in range(1, 251)
+		)
+
+		process_attendance_data(sn, test_data)
+
+		logs = frappe.get_all(
+			"ZK Log",
+			filters={"device_serial": sn},
+			fields=["name", "user_id", "processed", "employee_checkin"],
+		)
+		self.assertEqual(len(logs), 250)
+		self.assertEqual(len({log.name for log in logs}), 250)
+
+		# The known user's punch is checked in and linked; every link resolves
+		log = next(log for log in logs if log.user_id == "B001")
+		self.assertEqual(log.processed, 1)
+		checkin = frappe.db.get_value("Employee Checkin", log.employee_checkin, ["employee", "time"], as_dict=True)
+		self.assertEqual(checkin.employee, employee)
+		self.assertEqual(str(checkin.time), "2024-01-02 09:01:00")
+		for log in logs:
+			self.assertEqual(log.processed, 1 if log.employee_checkin else 0)
+			if log.employee_checkin:
+				self.assertTrue(frappe.db.exists("Employee Checkin", log.employee_checkin))
+
+		# A resent upload creates no second checkin
+		process_attendance_data(sn, test_data)
+		self.assertEqual(
+			frappe.db.count("Employee Checkin", {"employee": employee, "time": "2024-01-02 09:01:00"}), 1
+		)
+
+	def test_bulk_employee_checkin_rejects_unknown_user(self):
+		"""Test per-row results from the bulk checkin endpoint"""
+		from zk_adms.api import bulk_employee_checkin
+
+		results = bulk_employee_checkin([
+			{"user_id": "NO-SUCH-USER", "time": "2024-01-01 09:00:00", "log_type": "IN", "device_id": "TEST"},
+			{"user_id": "NO-SUCH-USER", "time": "not a time", "log_type": "IN", "device_id": "TEST"},
+		])
+		self.assertEqual([row["status"] for row in results], ["Failed", "Failed"])
+
+	def test_upload_batch_processing(self):
+		"""Test background processing of a queued upload"""
+		from zk_adms.api import process_upload_batch
+
+		sn = "TESTASYNC001"
+		batch = frappe.new_doc("ZK Upload Batch")
+		batch.device_serial = sn
+		batch.upload_table = "ATTLOG"
+		batch.record_count = 2
+		batch.data = "001\t2024-01-03 09:00:00\t0\t1\n002\t2024-01-03 18:00:00\t1\t1"
+		batch.insert(ignore_permissions=True)
+
+		process_upload_batch(batch.name)
+
+		self.assertEqual(frappe.db.get_value("ZK Upload Batch", batch.name, "status"), "Processed")
+		self.assertEqual(frappe.db.count("ZK Log", {"device_serial": sn}), 2)
+
+	def test_heartbeat_flush(self):
+		"""Test buffered heartbeats are written back to the device"""
+		from frappe.utils import get_datetime
+		from zk_adms.heartbeat import flush_heartbeats, record_heartbeat
+
+		sn = "TESTBEAT0001"
+		record_heartbeat(sn)
+		frappe.db.set_value("Attendance Device", sn, {"status": "Offline", "last_sync_time": "2024-01-01 00:00:00"})
+
+		flush_heartbeats()
+
+		device = frappe.db.get_value("Attendance Device", sn, ["status", "last_sync_time"], as_dict=True)
+		self.assertEqual(device.status, "Online")
+		self.assertGreater(get_datetime(device.last_sync_time), get_datetime("2024-01-01 00:00:00"))
+
+	def test_mark_offline_devices(self):
+		"""Test stale devices go offline and the transition is logged"""
+		from zk_adms.tasks import mark_offline_devices
+
+		sn = "TESTOFFLINE1"
+		get_or_create_device(sn)
+		frappe.db.set_value("Attendance Device", sn, {"status": "Online", "last_sync_time": "2024-01-01 00:00:00"})
+
+		mark_offline_devices()
+
+		self.assertEqual(frappe.db.get_value("Attendance Device", sn, "status"), "Offline")
+		self.assertTrue(frappe.db.exists("Attendance Device Status Log", {"device": sn, "status": "Offline"}))
+
+	def test_device_command_queue(self):
+		"""Test queued commands are handed out once and results recorded"""
+		from zk_adms.commands import get_command_response, push_command, record_command_results
+
+		sn = "TESTCMD00001"
+		get_or_create_device(sn)
+		command = frappe.new_doc("Attendance Device Command")
+		command.device = sn
+		command.command = "INFO"
+		command.insert(ignore_permissions=True)
+		push_command(sn, command.name)
+
+		self.assertEqual(get_command_response(sn), f"C:{command.name}:INFO\n")
+		self.assertEqual(get_command_response(sn), "OK")
+
+		record_command_results(sn, f"ID={command.name}&Return=0&CMD=INFO")
+		self.assertEqual(frappe.db.get_value("Attendance Device Command", command.name, "status"), "Succeeded")
+
+	def test_reupload_is_ignored(self):
+		"""Test a resent buffer does not create duplicate ZK Logs"""
+		sn = "TESTDEDUP001"
+		test_data = "001\t2024-01-04 09:00:00\t0\t1\n001\t2024-01-04 09:00:00\t0\t1\n002\t2024-01-04 18:00:00\t1\t1"
+
+		process_attendance_data(sn, test_data)
+		process_attendance_data(sn, test_data)
+
+		self.assertEqual(frappe.db.count("ZK Log", {"device_serial": sn}), 2)
+
+	def test_operlog_users(self):
+		"""Test USER lines in an OPERLOG upload become Attendance Device Users"""
+		import io
+		from zk_adms.api import ingest_upload
+		from zk_adms.parser import iter_lines
+
+		sn = "TESTOPLOG001"
+		get_or_create_device(sn)
+		data = b"OPLOG 4\t0\t2024-01-05 09:00:00\t0\t0\t0\t0\r\nUSER PIN=001\tName=Test User\tPri=0\tPasswd=\tCard=123\tGrp=1\r\n"
+
+		self.assertEqual(ingest_upload(sn, "OPERLOG", iter_lines(io.BytesIO(data))), 2)
+		self.assertEqual(
+			frappe.db.get_value("Attendance Device User", {"device": sn, "user_id": "001"}, "user_name"),
+			"Test User",
+		)
+
+	def test_raw_data_only_with_debug_capture(self):
+		"""Test ZK Log raw_data is kept only for devices with Debug Capture enabled"""
+		sn = "TESTDEBUG001"
+		device = get_or_create_device(sn)
+
+		process_attendance_data(sn, "001\t2024-01-06 09:00:00\t0\t1")
+		self.assertIsNone(frappe.db.get_value("ZK Log", {"device_serial": sn, "punch_type": "IN"}, "raw_data"))
+
+		device.debug_capture = 1
+		device.save(ignore_permissions=True)
+		process_attendance_data(sn, "001\t2024-01-06 18:00:00\t1\t1")
+		self.assertEqual(
+			frappe.db.get_value("ZK Log", {"device_serial": sn, "punch_type": "OUT"}, "raw_data"),
+			"001\t2024-01-06 18:00:00\t1\t1",
+		)
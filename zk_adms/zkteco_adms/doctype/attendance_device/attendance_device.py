@@ -1,7 +1,18 @@
 import frappe
 from frappe.model.document import Document
 
+from zk_adms.debug_capture import clear_capture_cache
+
 class AttendanceDevice(Document):
 	def before_save(self):
 		if not self.device_name:
-			self.device_name = f"ZKTeco Device {self.serial_number}"
\ No newline at end of file
+			self.device_name = f"ZKTeco Device {self.serial_number}"
+
+	def on_update(self):
+		clear_capture_cache()
+
+	def on_trash(self):
+		clear_capture_cache()
+
+	def after_rename(self, old, new, merge=False):
+		clear_capture_cache()
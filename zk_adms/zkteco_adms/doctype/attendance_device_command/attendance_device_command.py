@@ -0,0 +1,9 @@
+import frappe
+from frappe.model.document import Document
+
+from zk_adms.commands import push_command
+
+class AttendanceDeviceCommand(Document):
+	def after_insert(self):
+		# Only queue once the command row is committed
+		frappe.db.after_commit.add(lambda: push_command(self.device, self.name))
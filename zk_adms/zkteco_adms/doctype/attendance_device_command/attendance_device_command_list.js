@@ -0,0 +1,12 @@
+frappe.listview_settings['Attendance Device Command'] = {
+	add_fields: ["status"],
+	get_indicator: function(doc) {
+		const colors = {
+			"Pending": "orange",
+			"Sent": "blue",
+			"Succeeded": "green",
+			"Failed": "red"
+		};
+		return [__(doc.status), colors[doc.status], "status,=," + doc.status];
+	}
+};
\ No newline at end of file
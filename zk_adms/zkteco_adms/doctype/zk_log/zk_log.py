@@ -2,4 +2,8 @@ import frappe
 from frappe.model.document import Document
 
 class ZKLog(Document):
-	pass
\ No newline at end of file
+	pass
+
+def on_doctype_update():
+	# One row per punch; re-uploads of the same record are ignored
+	frappe.db.add_unique("ZK Log", ["device_serial", "user_id", "timestamp"], constraint_name="unique_device_punch")
@@ -0,0 +1,9 @@
+import frappe
+from frappe.model.document import Document
+
+class ZKUploadBatch(Document):
+	def validate(self):
+		# A Failed batch set back to Queued by hand gets a fresh set of attempts
+		if self.status == "Queued" and self.has_value_changed("status"):
+			self.attempts = 0
+			self.next_attempt_at = None
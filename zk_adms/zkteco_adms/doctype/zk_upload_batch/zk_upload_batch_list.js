@@ -0,0 +1,11 @@
+frappe.listview_settings['ZK Upload Batch'] = {
+	add_fields: ["status"],
+	get_indicator: function(doc) {
+		const colors = {
+			"Queued": "orange",
+			"Processed": "green",
+			"Failed": "red"
+		};
+		return [__(doc.status), colors[doc.status], "status,=," + doc.status];
+	}
+};
\ No newline at end of file
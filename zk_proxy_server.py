@@ -1,45 +1,586 @@
 #!/usr/bin/env python3
+"""Relay ZKTeco ADMS traffic from port 7788 to the Frappe site.
+
+Each device connection is handled in its own thread. Request and response
+bodies are streamed in chunks, and upstream connections are kept alive in
+a small pool instead of being opened per request.
+
+While the upstream is unreachable (or answers 502/503/504), cdata uploads
+are appended to a local spool and acknowledged with OK. A background
+thread replays the spool at a limited rate once the upstream is healthy.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import http.client
 import http.server
-import socketserver
-import urllib.request
+import json
+import logging
+import os
+import queue
+import select
+import struct
+import threading
+import time
 import urllib.parse
-from urllib.error import URLError
+
+UPSTREAM_HOST = os.environ.get('ZK_PROXY_UPSTREAM_HOST', 'localhost')
+UPSTREAM_PORT = int(os.environ.get('ZK_PROXY_UPSTREAM_PORT', 8000))
+# Sent as X-Frappe-Site-Name when the bench serves several sites
+SITE_NAME = os.environ.get('ZK_PROXY_SITE')
+PORT = int(os.environ.get('ZK_PROXY_PORT', 7788))
+
+POOL_SIZE = 16
+CHUNK_SIZE = 64 * 1024
+UPSTREAM_TIMEOUT = 60
+# Idle upstream connections older than this are dropped; keep it below the
+# upstream keep-alive timeout (gunicorn defaults to 2 seconds)
+POOL_IDLE_TIMEOUT = 1.5
+
+SPOOL_DIR = os.environ.get('ZK_PROXY_SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'zk_proxy_spool'))
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+# Replayed uploads per second, and devices replayed in parallel
+REPLAY_RATE = float(os.environ.get('ZK_PROXY_REPLAY_RATE', 20))
+REPLAY_CONCURRENCY = int(os.environ.get('ZK_PROXY_REPLAY_CONCURRENCY', 4))
+REPLAY_BATCH_SIZE = 32
+HEALTH_PATH = os.environ.get('ZK_PROXY_HEALTH_PATH', '/api/method/ping')
+HEALTH_CHECK_INTERVAL = 5
+# Uploads the upstream refused on replay (4xx), kept in the spool format
+DEAD_LETTER_FILE = 'rejected.log'
+
+# Upstream answers meaning the site is down rather than the request is bad
+BACKEND_DOWN_STATUSES = {502, 503, 504}
+
+# Hop-by-hop headers apply to a single connection and are not forwarded
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'transfer-encoding', 'upgrade',
+}
+# Answered by this server itself rather than relayed
+REQUEST_HEADERS_SKIPPED = HOP_BY_HOP_HEADERS | {'host', 'expect'}
+RESPONSE_HEADERS_SKIPPED = HOP_BY_HOP_HEADERS | {'server', 'date'}
+
+logger = logging.getLogger('zk_proxy')
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections to the upstream server"""
+
+    def __init__(self, host, port, size=POOL_SIZE, timeout=UPSTREAM_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def get(self):
+        """Return an idle connection that is still usable, or a new one"""
+        while True:
+            try:
+                conn, released_at = self.idle.get_nowait()
+            except queue.Empty:
+                return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+            if time.monotonic() - released_at < POOL_IDLE_TIMEOUT and not is_dropped(conn):
+                return conn
+            conn.close()
+
+    def put(self, conn):
+        try:
+            self.idle.put_nowait((conn, time.monotonic()))
+        except queue.Full:
+            conn.close()
+
+
+def is_dropped(conn):
+    """An idle connection that is readable has been closed by the server"""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class BackendUnavailable(Exception):
+    """The upstream answered with a gateway error"""
+
+
+class Spool:
+    """Append-only segment files holding cdata uploads until they are replayed.
+
+    Each record is a length header, JSON metadata (method, path, headers)
+    and the body, fsync'd before the device is acknowledged. The replay
+    position is kept in a cursor file; fully replayed segments are deleted.
+    Uploads the upstream rejects are moved to a dead-letter file.
+    """
+
+    HEADER = struct.Struct('>II')
+
+    def __init__(self, directory, segment_max_bytes=SEGMENT_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.lock = threading.Lock()
+
+        segments = self.segments()
+        # Always write to a new segment, so a record cut short by a crash
+        # can only be at the end of an older segment, where it is skipped
+        self.write_seq = segments[-1] + 1 if segments else 1
+        self.write_offset = 0
+        self.writer = None
+        self.appended = 0
+        self.pending = bool(segments)
+        self.cursor = self.load_cursor()
+
+    def segment_path(self, seq):
+        return os.path.join(self.directory, f'segment-{seq:08d}.log')
+
+    def segments(self):
+        return sorted(
+            int(name[8:-4]) for name in os.listdir(self.directory)
+            if name.startswith('segment-') and name.endswith('.log')
+        )
+
+    def load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, 'cursor.json')) as f:
+                cursor = json.load(f)
+            return cursor['segment'], cursor['offset']
+        except (OSError, ValueError, KeyError):
+            return 0, 0
+
+    def save_cursor(self, seq, offset):
+        path = os.path.join(self.directory, 'cursor.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'segment': seq, 'offset': offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        self.cursor = (seq, offset)
+
+    def append(self, meta, body):
+        """Durably store one upload"""
+        meta = json.dumps(meta).encode()
+        with self.lock:
+            if self.writer is None or self.write_offset >= self.segment_max_bytes:
+                self.rotate()
+            self.writer.write(self.HEADER.pack(len(meta), len(body)) + meta)
+            self.writer.write(body)
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+            self.write_offset = self.writer.tell()
+            self.appended += 1
+            self.pending = True
+
+    def rotate(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.write_seq += 1
+        self.writer = open(self.segment_path(self.write_seq), 'ab')
+        self.write_offset = 0
+        fsync_dir(self.directory)
+
+    def read_batch(self, limit):
+        """Return up to `limit` (segment, end offset, meta, body) records after the cursor"""
+        with self.lock:
+            active_seq, active_end = self.write_seq, self.write_offset
+
+        records = []
+        cursor_seq, cursor_offset = self.cursor
+        for seq in self.segments():
+            if seq < cursor_seq:
+                continue
+            offset = cursor_offset if seq == cursor_seq else 0
+            # The active segment is only read up to the last complete record
+            end = active_end if seq == active_seq else None
+            with open(self.segment_path(seq), 'rb') as f:
+                f.seek(offset)
+                while len(records) < limit and (end is None or offset < end):
+                    header = f.read(self.HEADER.size)
+                    if len(header) < self.HEADER.size:
+                        break
+                    meta_length, body_length = self.HEADER.unpack(header)
+                    meta = f.read(meta_length)
+                    body = f.read(body_length)
+                    if len(meta) < meta_length or len(body) < body_length:
+                        break
+                    offset = f.tell()
+                    records.append((seq, offset, json.loads(meta), body))
+            if len(records) >= limit:
+                break
+        return records
+
+    def reject(self, meta, body, status):
+        """Keep an upload the upstream refused, with its status, in the dead-letter file"""
+        meta = json.dumps(dict(meta, status=status, rejected_at=time.time())).encode()
+        with self.lock, open(os.path.join(self.directory, DEAD_LETTER_FILE), 'ab') as f:
+            f.write(self.HEADER.pack(len(meta), len(body)) + meta)
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def commit(self, seq, offset):
+        """Mark everything up to (seq, offset) as replayed"""
+        self.save_cursor(seq, offset)
+        for old in self.segments():
+            if old < seq:
+                os.remove(self.segment_path(old))
+
+    def drained(self, appended):
+        """Clear the spool if nothing was appended since `appended` was read"""
+        with self.lock:
+            if self.appended != appended:
+                return False
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+                self.write_seq += 1
+            for seq in self.segments():
+                os.remove(self.segment_path(seq))
+            self.save_cursor(self.write_seq, 0)
+            self.pending = False
+            return True
+
+
+def fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class RateLimiter:
+    """Space calls evenly at `rate` per second across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_at = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_until = max(self.next_at, now)
+            self.next_at = wait_until + self.interval
+        if wait_until > now:
+            time.sleep(wait_until - now)
+
+
+class SpoolReplayer(threading.Thread):
+    """Send spooled uploads upstream once it is healthy again"""
+
+    daemon = True
+
+    def __init__(self, spool):
+        super().__init__(name='spool-replayer')
+        self.spool = spool
+        self.limiter = RateLimiter(REPLAY_RATE)
+        self.executor = ThreadPoolExecutor(REPLAY_CONCURRENCY)
+
+    def run(self):
+        while True:
+            if not self.spool.pending:
+                time.sleep(1)
+                continue
+            if not backend_healthy():
+                backend_down.set()
+                time.sleep(HEALTH_CHECK_INTERVAL)
+                continue
+            backend_down.clear()
+
+            try:
+                appended = self.spool.appended
+                records = self.spool.read_batch(REPLAY_BATCH_SIZE)
+                if not records:
+                    if self.spool.drained(appended):
+                        logger.info('Spool drained, relaying uploads directly')
+                    continue
+                if self.replay(records):
+                    seq, offset = records[-1][:2]
+                    self.spool.commit(seq, offset)
+                else:
+                    backend_down.set()
+                    time.sleep(HEALTH_CHECK_INTERVAL)
+            except Exception as e:
+                logger.exception('Spool replay error: %s', e)
+                time.sleep(HEALTH_CHECK_INTERVAL)
+
+    def replay(self, records):
+        """Replay a batch; each device's uploads are sent in order by one task.
+
+        Returns False if any upload could not be delivered. The whole batch
+        is then retried, which the site tolerates because re-uploaded
+        punches are deduplicated.
+        """
+        by_device = {}
+        for record in records:
+            by_device.setdefault(device_serial(record[2]['path']), []).append(record)
+
+        futures = [self.executor.submit(self.replay_device, group) for group in by_device.values()]
+        return all(future.result() for future in futures)
+
+    def replay_device(self, records):
+        for _seq, _offset, meta, body in records:
+            self.limiter.wait()
+            try:
+                status, reply = send_upstream(meta['method'], meta['path'], body, meta['headers'])
+            except (OSError, http.client.HTTPException) as e:
+                logger.warning('Replay of %s failed: %s', meta['path'], e)
+                return False
+            if status >= 500:
+                logger.warning('Replay of %s failed with HTTP %s', meta['path'], status)
+                return False
+            if status < 400 and not reply.startswith(b'OK'):
+                # The site answers ERROR with HTTP 200 when ingest failed
+                # (e.g. a rolled back bulk insert); keep it spooled and retry
+                logger.warning('Replay of %s failed: %r', meta['path'], reply[:200])
+                return False
+            if status >= 400:
+                # Retrying will not help and the device was already told OK;
+                # set it aside rather than block the spool
+                self.spool.reject(meta, body, status)
+                logger.error(
+                    'Replay of %s rejected with HTTP %s, kept in %s',
+                    meta['path'], status, DEAD_LETTER_FILE
+                )
+        return True
+
+
+def device_serial(path):
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(path).query)
+    return (query.get('SN') or [''])[0]
+
+
+def send_upstream(method, path, body, headers):
+    """Send one buffered request through the pool and return (status, body)"""
+    conn = pool.get()
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        reply = response.read()
+    except Exception:
+        conn.close()
+        raise
+    if response.will_close:
+        conn.close()
+    else:
+        pool.put(conn)
+    return response.status, reply
+
+
+def backend_healthy():
+    headers = {'Host': f'{UPSTREAM_HOST}:{UPSTREAM_PORT}'}
+    if SITE_NAME:
+        headers['X-Frappe-Site-Name'] = SITE_NAME
+    try:
+        return send_upstream('GET', HEALTH_PATH, None, headers)[0] < 500
+    except (OSError, http.client.HTTPException):
+        return False
+
+
+pool = ConnectionPool(UPSTREAM_HOST, UPSTREAM_PORT)
+spool = None
+# Set while the upstream is failing; uploads go to the spool until it is
+# healthy again and the spool has been replayed
+backend_down = threading.Event()
+
 
 class ZKProxyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
     def do_GET(self):
         self.proxy_request()
-    
+
     def do_POST(self):
         self.proxy_request()
-    
+
     def proxy_request(self):
+        spoolable = spool is not None and self.is_upload()
+        if spoolable and (backend_down.is_set() or spool.pending):
+            # Keep uploads in order behind those already spooled
+            body = bytearray()
+            try:
+                for _chunk in self.iter_request_body(body):
+                    pass
+            except OSError as e:
+                self.log_error('Device error: %s', e)
+                self.close_connection = True
+                return
+            self.spool_upload(body)
+            return
+
+        self.response_started = False
+        self.body_complete = False
+        # Uploads are copied while streamed so they can be spooled on failure
+        body_copy = bytearray() if spoolable else None
+        body = self.iter_request_body(body_copy) if self.has_body() else None
+        conn = pool.get()
+        try:
+            # The original path (cdata, getrequest, devicecmd) and query
+            # string are forwarded unchanged
+            conn.request(
+                self.command,
+                self.path,
+                body=body,
+                headers=self.upstream_headers(),
+                encode_chunked=self.is_chunked(),
+            )
+            response = conn.getresponse()
+            if spoolable and response.status in BACKEND_DOWN_STATUSES:
+                raise BackendUnavailable(f'HTTP {response.status}')
+            self.relay_response(response)
+        except (OSError, http.client.HTTPException, BackendUnavailable) as e:
+            conn.close()
+            self.log_error('Upstream error: %s', e)
+            if self.response_started:
+                # Part of the response is already out; all we can do is drop it
+                self.close_connection = True
+            elif spoolable and self.finish_body(body, body_copy):
+                backend_down.set()
+                self.spool_upload(body_copy)
+            else:
+                self.send_error_response()
+            return
+
+        if response.will_close:
+            conn.close()
+        else:
+            pool.put(conn)
+
+    def is_upload(self):
+        return self.command == 'POST' and urllib.parse.urlparse(self.path).path.rstrip('/').endswith('/cdata')
+
+    def finish_body(self, body, body_copy):
+        """Read the rest of a partly forwarded body; False if the device went away"""
+        if body is not None and not self.body_complete:
+            try:
+                for _chunk in body:
+                    pass
+            except OSError:
+                return False
+        return body is None or self.body_complete
+
+    def spool_upload(self, body):
+        headers = self.upstream_headers()
+        headers['Content-Length'] = str(len(body))
+        try:
+            spool.append({'method': self.command, 'path': self.path, 'headers': headers}, bytes(body))
+        except OSError as e:
+            self.log_error('Spool error: %s', e)
+            self.send_error_response()
+            return
+
+        reply = b'OK'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def has_body(self):
+        return self.is_chunked() or int(self.headers.get('Content-Length') or 0) > 0
+
+    def is_chunked(self):
+        return 'chunked' in self.headers.get('Transfer-Encoding', '').lower()
+
+    def upstream_headers(self):
+        headers = {
+            key: value for key, value in self.headers.items()
+            if key.lower() not in REQUEST_HEADERS_SKIPPED
+        }
+        headers['Host'] = f'{UPSTREAM_HOST}:{UPSTREAM_PORT}'
+        headers['X-Forwarded-Host'] = self.headers.get('Host', '')
+        headers['X-Forwarded-For'] = self.client_address[0]
+        if SITE_NAME:
+            headers['X-Frappe-Site-Name'] = SITE_NAME
+        return headers
+
+    def iter_request_body(self, copy=None):
+        """Yield the request body in chunks as it arrives from the device.
+
+        Chunks are also appended to `copy` when given.
+        """
+        for chunk in self.read_request_body():
+            if copy is not None:
+                copy.extend(chunk)
+            yield chunk
+        self.body_complete = True
+
+    def read_request_body(self):
+        if self.is_chunked():
+            while True:
+                size = int(self.rfile.readline().split(b';', 1)[0].strip() or b'0', 16)
+                if size == 0:
+                    # Skip trailers up to the blank line
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+
+        remaining = int(self.headers.get('Content-Length') or 0)
+        while remaining > 0:
+            chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ConnectionError('Device closed the connection mid-body')
+            remaining -= len(chunk)
+            yield chunk
+
+    def relay_response(self, response):
+        """Write the upstream status, headers and body back to the device"""
+        self.response_started = True
+        self.send_response(response.status, response.reason)
+        for key, value in response.getheaders():
+            if key.lower() not in RESPONSE_HEADERS_SKIPPED:
+                self.send_header(key, value)
+
+        has_length = response.getheader('Content-Length') is not None
+        chunked = not has_length and self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        elif not has_length:
+            # HTTP/1.0 device and unknown length: end the body by closing
+            self.close_connection = True
+            self.send_header('Connection', 'close')
+        self.end_headers()
+
+        while True:
+            # read() with a size marks the response complete at the end of
+            # the body, which the connection needs before it can be reused
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if chunked:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            else:
+                self.wfile.write(chunk)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+    def send_error_response(self):
+        body = b'ERROR'
+        self.close_connection = True
         try:
-            # Get request data
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length) if content_length > 0 else None
-            
-            # Build target URL
-            query_string = urllib.parse.urlparse(self.path).query
-            target_url = f"http://localhost:8000/iclock/?{query_string}"
-            
-            # Create request
-            req = urllib.request.Request(target_url, data=post_data, method=self.command)
-            req.add_header('Content-Type', self.headers.get('Content-Type', 'application/x-www-form-urlencoded'))
-            
-            # Forward request
-            with urllib.request.urlopen(req) as response:
-                self.send_response(response.status)
-                self.send_header('Content-Type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(response.read())
-                
-        except URLError as e:
             self.send_response(500)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Connection', 'close')
             self.end_headers()
-            self.wfile.write(b"ERROR")
+            self.wfile.write(body)
+        except OSError:
+            pass
+
+
+class ZKProxyServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
 
 if __name__ == "__main__":
-    PORT = 7788
-    with socketserver.TCPServer(("", PORT), ZKProxyHandler) as httpd:
-        print(f"ZK Proxy server running on port {PORT}")
-        httpd.serve_forever()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    spool = Spool(SPOOL_DIR)
+    SpoolReplayer(spool).start()
+
+    with ZKProxyServer(("", PORT), ZKProxyHandler) as httpd:
+        logger.info("ZK Proxy server running on port %s -> %s:%s", PORT, UPSTREAM_HOST, UPSTREAM_PORT)
+        httpd.serve_forever()